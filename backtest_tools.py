@@ -0,0 +1,79 @@
+import pandas as pd
+import numpy as np
+from panel_tools import factor_design, masked_ols, rolling_masked_ols
+
+# decile of every value in each row, highest values in the last decile, -1 where the value is NaN
+def row_deciles(values, n_deciles=10):
+    valid = ~np.isnan(values)
+    # rank within each row with NaN sorted last
+    order = np.argsort(np.where(valid, values, np.inf), axis=1, kind='stable')
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(values.shape[1])[None, :], axis=1)
+    n_valid = valid.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        deciles = np.floor(ranks * n_deciles / n_valid).astype(int)
+    return np.where(valid, deciles, -1)
+
+# rank funds by trailing alpha at every rebalance date and track the out-of-sample decile portfolios
+def alpha_persistence_backtest(panel, ff_df, ff_factors=['Mkt-RF'], window=36, rebalance_every=12, n_deciles=10,
+                               rank_by='alpha', min_obs=None, start_date=None, end_date=None):
+    '''
+    panel: df from build_panel
+    ff_df: df
+    ff_factors: list of strings, the factor model used for ranking and for the out-of-sample alphas
+    window: months of history behind each ranking
+    rebalance_every: months each set of decile portfolios is held
+    n_deciles: number of portfolios, the last one holds the highest alphas
+    rank_by: 'alpha' or 'tstat' of the trailing alpha
+    min_obs: months a fund needs in the trailing window to be ranked, defaults to three quarters of it
+    returns dict of decile_returns (months x deciles, equal weighted excess returns in percent),
+    summary (mean return, out-of-sample alpha and its t-stat per decile and for the top minus bottom spread),
+    assignments (rebalance dates x tickers, decile or -1) and rebalance_dates
+    '''
+    if min_obs is None:
+        min_obs = window * 3 // 4
+    y, mask, x = factor_design(panel, ff_df, ff_factors, start_date, end_date)
+
+    # one batched sweep of trailing fits over every rebalance date and fund
+    n_months = len(y)
+    rows = np.arange(window - 1, n_months - 1, rebalance_every)
+    fits = rolling_masked_ols(y, x, mask, window, rows, min_obs)
+    score = fits['params'][:, :, 0] if rank_by == 'alpha' else fits['tstat'][:, :, 0]
+    assignments = row_deciles(score, n_deciles)
+
+    # every month after a rebalance date is held with that date's deciles
+    period = np.searchsorted(rows, np.arange(n_months), side='left') - 1
+    held = period >= 0
+    months = np.flatnonzero(held)
+    decile_of = assignments[period[months]]
+
+    returns = np.where(mask[months], y[months], 0.0)
+    decile_returns = np.full((n_months, n_deciles), np.nan)
+    for d in range(n_deciles):
+        members = (decile_of == d) & mask[months]
+        count = members.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            decile_returns[months, d] = np.where(count > 0, (returns * members).sum(axis=1) / count, np.nan)
+
+    columns = ['decile_' + str(d + 1) for d in range(n_deciles)]
+    decile_returns = pd.DataFrame(decile_returns, index=panel.index, columns=columns)
+    decile_returns['spread'] = decile_returns[columns[-1]] - decile_returns[columns[0]]
+
+    # out-of-sample alpha of every decile portfolio and the spread, fitted together
+    portfolio = decile_returns.to_numpy()
+    portfolio_mask = ~np.isnan(portfolio) & ~np.isnan(x).any(axis=1)[:, None]
+    oos = masked_ols(portfolio, np.nan_to_num(x), portfolio_mask)
+    summary = pd.DataFrame({
+        'mean_return': decile_returns.mean(),
+        'alpha': oos['params'][:, 0],
+        'alpha_tstat': oos['tstat'][:, 0],
+        'n_months': oos['n_obs'],
+    }, index=decile_returns.columns)
+
+    rebalance_dates = panel.index[rows]
+    return {
+        'decile_returns': decile_returns,
+        'summary': summary,
+        'assignments': pd.DataFrame(assignments, index=rebalance_dates, columns=panel.columns),
+        'rebalance_dates': rebalance_dates,
+    }
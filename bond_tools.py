@@ -0,0 +1,87 @@
+import pandas as pd
+from panel_tools import build_panel, panel_categories, build_benchmark_panel, batch_factor_model, batch_capm_index, panel_coverage
+
+# treasury maturities in each duration bucket, by the column prefix of get_bond_data
+DURATION_BUCKETS = {
+    'SHORT': ['1 Year', '2 Year'],
+    'INTER': ['5 Year', '7 Year', '10 Year'],
+    'LONG': ['20 Year', '30 Year'],
+}
+
+# factor sets of the fixed income models
+BOND_MODELS = {
+    'term': ['TERM', 'INFL'],
+    'duration': ['SHORT', 'INTER', 'LONG', 'INFL'],
+}
+
+# derive monthly bond factors in percent from the treasury and cpi series
+def get_bond_factors(bond_df):
+    '''
+    bond_df: df, as returned by get_bond_data
+    returns df with date, RF (30 day bill), TERM (30 year minus 1 year), SHORT, INTER, LONG
+    (duration bucket excess returns over the bill) and INFL (cpi inflation)
+    '''
+    factors = pd.DataFrame({'date': bond_df['date']})
+    rf = bond_df['30 Day Bond Return'] * 100
+    factors['RF'] = rf
+    factors['TERM'] = (bond_df['30 Year Bond Return'] - bond_df['1 Year Bond Return']) * 100
+    for bucket, maturities in DURATION_BUCKETS.items():
+        returns = bond_df[[maturity + ' Bond Return' for maturity in maturities]]
+        factors[bucket] = returns.mean(axis=1) * 100 - rf
+    factors['INFL'] = bond_df['CPI Return'] * 100
+    return factors.reset_index(drop=True)
+
+# split mutual fund data for the US Fixed Income categories only
+def fixed_income_funds(mf_dict):
+    return {key: data for key, data in mf_dict.items() if key[1] == 'US Fixed Income'}
+
+# run every fixed income model for all bond funds in batch
+def run_bond_models(mf_dict, bond_df, index_dict, start_date=None, end_date=None):
+    '''
+    mf_dict: dict of (ticker, asset_class, category) -> df, as returned by get_mutual_fund_data
+    bond_df: df, as returned by get_bond_data
+    index_dict: dict, as returned by get_index_data
+    returns dict of model name -> df of results indexed by ticker, plus category and coverage
+    '''
+    bond_funds = fixed_income_funds(mf_dict)
+    panel = build_panel(bond_funds)
+    categories = panel_categories(bond_funds)
+    bond_factors = get_bond_factors(bond_df)
+
+    results = {}
+    for model, factors in BOND_MODELS.items():
+        results[model] = batch_factor_model(panel, bond_factors, factors, start_date, end_date)
+
+    # benchmark CAPM over the bill rate, against each fund's category index
+    bench_panel = build_benchmark_panel(panel, categories, index_dict)
+    results['benchmark'] = batch_capm_index(panel, bond_factors, bench_panel, start_date, end_date)
+
+    results['category'] = pd.Series({ticker: category[1] for ticker, category in categories.items()}, name='category')
+    results['coverage'] = panel_coverage(panel, bond_factors, start_date, end_date)
+    return results
+
+# mean and standard deviation of every result column by category
+def summarize_bond_models(results, column='const'):
+    summary = {}
+    for model in list(BOND_MODELS.keys()) + ['benchmark']:
+        grouped = results[model][column].groupby(results['category'])
+        summary[model] = grouped.mean()
+        summary[model + '_std'] = grouped.std(ddof=0)
+    return pd.DataFrame(summary)
+
+# lagged public information variables of the conditional models, from the treasury and cpi series
+def get_state_variables(bond_df, lag=1):
+    '''
+    bond_df: df, as returned by get_bond_data
+    lag: months the variables are lagged, so each month only uses information known at its start
+    returns df with date, TBILL (annualized 90 day bill yield), TERM (10 year bond minus 90 day bill return)
+    and INFL (cpi inflation), all in percent
+    '''
+    bond_df = bond_df.sort_values('date')
+    states = pd.DataFrame({
+        'TBILL': bond_df['90 Day Bond Return'] * 12 * 100,
+        'TERM': (bond_df['10 Year Bond Return'] - bond_df['90 Day Bond Return']) * 100,
+        'INFL': bond_df['CPI Return'] * 100,
+    }).shift(lag)
+    states.insert(0, 'date', bond_df['date'])
+    return states.reset_index(drop=True)
@@ -0,0 +1,91 @@
+import pandas as pd
+import numpy as np
+from panel_tools import build_panel, build_benchmark_panel, batch_factor_model, batch_capm_index, batch_corr_index, FACTOR_MODELS
+
+# mean and population standard deviation of values grouped by category id, NaN values left out
+def group_stats(values, category_ids, n_categories):
+    valid = ~np.isnan(values)
+    ids = category_ids[valid]
+    counts = np.bincount(ids, minlength=n_categories)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.bincount(ids, values[valid], minlength=n_categories) / counts
+        stds = np.sqrt(np.bincount(ids, (values[valid] - means[ids]) ** 2, minlength=n_categories) / counts)
+    return counts, means, stds
+
+# one sigma band of every fund within its category: 1 above mean + std, -1 below mean - std, 0 inside, NaN if unfitted
+def sigma_bands(values, category_ids, means, stds):
+    bands = np.where(values > means[category_ids] + stds[category_ids], 1.0, 0.0)
+    bands = np.where(values < means[category_ids] - stds[category_ids], -1.0, bands)
+    return np.where(np.isnan(values), np.nan, bands)
+
+# every model and the sigma band classification for all categories of the universe in one batched pass
+def run_category_engine(mf_dict, ff_df, index_dict, universe, models=FACTOR_MODELS, excluded=(), start_date=None,
+                        end_date=None, min_obs=None):
+    '''
+    mf_dict: dict of (ticker, asset_class, category) -> df, as returned by get_mutual_fund_data
+    ff_df: df
+    index_dict: dict, as returned by get_index_data
+    universe: FundUniverse
+    excluded: tickers left out of the analysis
+    returns dict of funds (df of fund and category ids by ticker), results (model -> batch results df),
+    corr (correlation with the category benchmark), summary (df by category id of funds, mean and std
+    of alpha and mean beta for every model) and bands (df of the sigma band of every fund for every model)
+    '''
+    # one panel in fund id order, every category side by side
+    fund_ids = universe.fund_ids([key[0] for key in mf_dict])
+    keep = (fund_ids >= 0) & ~np.isin([key[0] for key in mf_dict], list(excluded))
+    keys = [key for key, kept in zip(mf_dict, keep) if kept]
+    order = np.argsort(fund_ids[keep], kind='stable')
+    panel = build_panel({keys[i]: mf_dict[keys[i]] for i in order})
+    fund_ids = universe.fund_ids(panel.columns)
+    category_ids = universe.fund_category[fund_ids]
+    n_categories = len(universe.categories)
+
+    categories = [universe.categories[c] for c in category_ids]
+
+    funds = pd.DataFrame({
+        'fund_id': fund_ids,
+        'category_id': category_ids,
+        'asset_class': [asset_class for asset_class, category in categories],
+        'category': [category for asset_class, category in categories],
+    }, index=panel.columns)
+
+    # the estimators run once over every group, each fund against its own category's benchmark
+    bench_panel = build_benchmark_panel(panel, dict(zip(panel.columns, categories)), index_dict)
+    results = {}
+    for model, factors in models.items():
+        if factors is None:
+            results[model] = batch_capm_index(panel, ff_df, bench_panel, start_date, end_date, min_obs)
+        else:
+            results[model] = batch_factor_model(panel, ff_df, factors, start_date, end_date, min_obs)
+    corr = batch_corr_index(panel, bench_panel, start_date, end_date)
+
+    summary = {}
+    bands = {}
+    for model, result in results.items():
+        alphas = result['const'].to_numpy(dtype=float)
+        beta = result['beta' if models[model] is None else 'Mkt-RF'].to_numpy(dtype=float)
+        counts, means, stds = group_stats(alphas, category_ids, n_categories)
+        summary[model + '_funds'] = counts
+        summary[model + '_alpha'] = means
+        summary[model + '_alpha_std'] = stds
+        summary[model + '_beta'] = group_stats(beta, category_ids, n_categories)[1]
+        bands[model] = sigma_bands(alphas, category_ids, means, stds)
+
+    summary = pd.DataFrame(summary)
+    summary.insert(0, 'asset_class', [asset_class for asset_class, category in universe.categories])
+    summary.insert(1, 'category', [category for asset_class, category in universe.categories])
+    summary.index.name = 'category_id'
+    return {
+        'funds': funds,
+        'results': results,
+        'corr': corr,
+        'summary': summary,
+        'bands': pd.DataFrame(bands, index=panel.columns),
+    }
+
+# tickers of one category above (side=1) or below (side=-1) the sigma band of a model
+def band_funds(engine, model, category_id, side=1):
+    funds = engine['funds']
+    in_band = (funds['category_id'] == category_id) & (engine['bands'][model] == side)
+    return list(funds.index[in_band])
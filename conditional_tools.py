@@ -0,0 +1,93 @@
+import pandas as pd
+import numpy as np
+from panel_tools import align_frame, excess_panel, factor_design, masked_ols, results_frame, window_mask
+from bond_tools import get_state_variables
+
+# state variables the conditional betas move with, columns of get_state_variables
+STATE_VARIABLES = ['TBILL', 'TERM', 'INFL']
+
+# factor sets of the conditional models
+CONDITIONAL_MODELS = {
+    'capm': ['Mkt-RF'],
+    'ff5': ['Mkt-RF', 'SMB', 'HML', 'RMW', 'CMA'],
+}
+
+# design matrix shared by every fund: constant, factors and factor x lagged state interactions
+def conditional_design(ff, states, ff_factors, state_variables=STATE_VARIABLES, months=None, time_varying_alpha=False):
+    '''
+    ff: df of factors aligned to the panel calendar
+    states: df of lagged state variables aligned to the same calendar
+    months: bool array of the months the states are demeaned over, None for every month
+    time_varying_alpha: also let alpha move with the states
+    returns the months x regressors array and the regressor names
+    '''
+    z = states[state_variables].to_numpy(dtype=float)
+    if months is None:
+        months = np.ones(len(z), dtype=bool)
+    # demeaned states make the constant the alpha and the factor loadings the betas at average conditions
+    z = z - np.nanmean(z[months], axis=0)
+    f = ff[ff_factors].to_numpy(dtype=float)
+
+    columns = [np.ones(len(f)), f]
+    names = ['const'] + list(ff_factors)
+    if time_varying_alpha:
+        columns.append(z)
+        names += ['const*' + state for state in state_variables]
+    columns.append((f[:, :, None] * z[:, None, :]).reshape(len(f), -1))
+    names += [factor + '*' + state for factor in ff_factors for state in state_variables]
+    return np.column_stack(columns), names
+
+# batched Ferson-Schadt conditional factor model of every fund in the panel
+def batch_conditional_model(panel, ff_df, bond_df, ff_factors, state_variables=STATE_VARIABLES, start_date=None,
+                            end_date=None, time_varying_alpha=False, min_obs=None):
+    '''
+    panel: df from build_panel
+    ff_df: df
+    bond_df: df, as returned by get_bond_data
+    ff_factors: list of strings
+    state_variables: columns of get_state_variables the betas are linear in
+    time_varying_alpha: add the states to the constant as well (Christopherson-Ferson-Glassman)
+    returns df indexed by ticker with the conditional alpha (const), the average betas,
+    the interaction slopes (factor*state) and their t-stats
+    '''
+    y, mask, ff = excess_panel(panel, ff_df, start_date, end_date)
+    states = align_frame(get_state_variables(bond_df), panel.index)
+    months = window_mask(panel.index, start_date, end_date)
+    x, names = conditional_design(ff, states, ff_factors, state_variables, months, time_varying_alpha)
+    mask &= ~np.isnan(x).any(axis=1)[:, None]
+
+    fit = masked_ols(y, x, mask, min_obs)
+    return results_frame(fit, names, panel.columns)
+
+# conditional and unconditional fits of every model over the same months, to split timing from skill
+def run_conditional_models(panel, ff_df, bond_df, models=CONDITIONAL_MODELS, start_date=None, end_date=None,
+                           time_varying_alpha=False, min_obs=None):
+    '''
+    panel: df from build_panel
+    ff_df: df
+    bond_df: df, as returned by get_bond_data
+    returns dict of model name -> conditional results, plus model name + '_alpha' -> df of the
+    unconditional and conditional alpha and their difference, which is the alpha explained by
+    betas moving with public information
+    '''
+    results = {}
+    states = align_frame(get_state_variables(bond_df), panel.index)
+    for model, factors in models.items():
+        conditional = batch_conditional_model(panel, ff_df, bond_df, factors, start_date=start_date, end_date=end_date,
+                                              time_varying_alpha=time_varying_alpha, min_obs=min_obs)
+
+        y, mask, x = factor_design(panel, ff_df, factors, start_date, end_date)
+        # the unconditional fit skips the months without lagged states too, so both use the same sample
+        z = states[STATE_VARIABLES].to_numpy(dtype=float)
+        mask &= ~np.isnan(z).any(axis=1)[:, None]
+        unconditional = masked_ols(y, x, mask, min_obs)
+
+        results[model] = conditional
+        results[model + '_alpha'] = pd.DataFrame({
+            'alpha': unconditional['params'][:, 0],
+            'alpha_tstat': unconditional['tstat'][:, 0],
+            'conditional_alpha': conditional['const'],
+            'conditional_alpha_tstat': conditional['const_tstat'],
+            'timing_alpha': unconditional['params'][:, 0] - conditional['const'],
+        }, index=panel.columns)
+    return results
@@ -74,21 +74,36 @@ def reg_date_range(eq_data, ff_df, ff_factors, start_date, end_date):
     end_date: date in string
     '''
     results = {}
-    type_data = eq_data.copy()
-    temp_ff = ff_df[(ff_df['date'] >= start_date) & (ff_df['date'] <= end_date)].reset_index().drop('index', axis=1)
-    type_data = type_data[(type_data['date'] >= start_date) & (type_data['date'] <= end_date)].reset_index().drop('index', axis=1)
+    # join on month so missing months drop out instead of shifting rows
+    joined = join_date_range(eq_data, ff_df, None, start_date, end_date, ff_factors)
 
-    x = sm.add_constant(temp_ff[ff_factors])
-    y = type_data['nav_return']*100 - temp_ff['RF']
-    if len(temp_ff) == len(type_data):
+    if len(joined) >= len(ff_factors) + 2:
+        x = sm.add_constant(joined[ff_factors])
+        y = joined['nav_return']*100 - joined['RF']
         model = sm.OLS(y, x).fit(cov_type='HC0')
 
-        ff_factors.insert(0, 'const')
-        for factor in ff_factors:
+        for factor in ['const'] + list(ff_factors):
             results[factor]=model.params[factor]
         return results
     return None
 
+def join_date_range(eq_data, ff_df, index_df, start_date, end_date, ff_factors=()):
+    '''
+    eq_data: df
+    ff_df: df, or None to skip the factors
+    index_df: df, or None to skip the benchmark
+    start_date: date in string
+    end_date: date in string
+    returns the months inside the range where the fund and every requested series have data
+    '''
+    joined = eq_data[['date', 'nav_return']]
+    if ff_df is not None:
+        joined = joined.merge(ff_df[['date', 'RF'] + [f for f in ff_factors if f != 'RF']], on='date', how='inner')
+    if index_df is not None:
+        joined = joined.merge(index_df[['Date', '% Change']].rename(columns={'Date': 'date'}), on='date', how='inner')
+    joined = joined[(joined['date'] >= start_date) & (joined['date'] <= end_date)]
+    return joined.dropna(how='any').reset_index(drop=True)
+
 def capm_index(eq_data, ff_df, index_df, start_date, end_date):
     '''
     eq_data: df
@@ -97,17 +112,14 @@ def capm_index(eq_data, ff_df, index_df, start_date, end_date):
     start_date: date in string
     end_date: date in string
     '''
-    type_data = eq_data.copy()
-    temp_ff = ff_df[(ff_df['date'] >= start_date) & (ff_df['date'] <= end_date)].reset_index().drop('index', axis=1)
-    type_data = type_data[(type_data['date'] >= start_date) & (type_data['date'] <= end_date)].reset_index().drop('index', axis=1)
-    index_data = index_df[(index_df['Date'] >= start_date) & (index_df['Date'] <= end_date)].reset_index().drop('index', axis=1)
-    
-    if len(temp_ff) == len(type_data) == len(index_data):
-        x = sm.add_constant(index_data['% Change'] - temp_ff['RF'])
-        y = type_data['nav_return']*100 - temp_ff['RF']
+    joined = join_date_range(eq_data, ff_df, index_df, start_date, end_date)
+
+    if len(joined) >= 3:
+        x = sm.add_constant(joined['% Change'] - joined['RF'])
+        y = joined['nav_return']*100 - joined['RF']
         model = sm.OLS(y, x).fit(cov_type='HC0')
 
-        results = {'const': model.params['const'], 'beta': model.params[0]}
+        results = {'const': model.params['const'], 'beta': model.params.iloc[1]}
         return results
     return None
 
@@ -119,13 +131,11 @@ def corr_index(eq_data, index_df, start_date, end_date):
     start_date: date in string
     end_date: date in string
     '''
-    type_data = eq_data.copy()
-    type_data = type_data[(type_data['date'] >= start_date) & (type_data['date'] <= end_date)].reset_index().drop('index', axis=1)
-    index_data = index_df[(index_df['Date'] >= start_date) & (index_df['Date'] <= end_date)].reset_index().drop('index', axis=1)
+    joined = join_date_range(eq_data, None, index_df, start_date, end_date)
 
-    index_pct_change = index_data['% Change']
-    mf_pct_change = type_data['nav_return']*100
+    index_pct_change = joined['% Change']
+    mf_pct_change = joined['nav_return']*100
 
-    if len(type_data) == len(index_data):
+    if len(joined) >= 3:
         return np.corrcoef(index_pct_change, mf_pct_change)[0][1]
     return None
@@ -0,0 +1,127 @@
+import pandas as pd
+import numpy as np
+from scipy import stats
+
+# thresholds lambda of the Storey estimate of the share of zero alpha funds
+STOREY_LAMBDAS = np.arange(0.05, 0.95, 0.05)
+
+# two sided p-values of t-stats, from the t distribution if the degrees of freedom are given, else the normal
+def tstat_pvalues(tstats, dof=None):
+    tstats = np.asarray(tstats, dtype=float)
+    if dof is None:
+        return 2 * stats.norm.sf(np.abs(tstats))
+    return 2 * stats.t.sf(np.abs(tstats), dof)
+
+# Storey estimate of the share of true nulls, lambda chosen by bootstrap mean squared error
+def storey_pi0(pvalues, lambdas=STOREY_LAMBDAS, n_boot=1000, seed=0):
+    '''
+    pvalues: array of p-values, NaN are ignored
+    lambdas: candidate thresholds, p-values above lambda are mostly from zero alpha funds
+    n_boot: bootstrap samples, drawn as multinomial counts over the lambda bins so no p-values are resampled
+    returns pi0 and the chosen lambda
+    '''
+    pvalues = np.asarray(pvalues, dtype=float)
+    pvalues = pvalues[~np.isnan(pvalues)]
+    n = len(pvalues)
+    if n == 0:
+        return np.nan, np.nan
+    lambdas = np.asarray(lambdas, dtype=float)
+
+    # p-values above each lambda are the counts of the bins above it
+    bins = np.bincount(np.searchsorted(lambdas, pvalues, side='left'), minlength=len(lambdas) + 1)
+    above = lambda counts: counts[..., ::-1].cumsum(axis=-1)[..., ::-1][..., 1:]
+    pi0 = above(bins) / (n * (1 - lambdas))
+
+    boot = np.random.default_rng(seed).multinomial(n, bins / n, size=n_boot)
+    boot_pi0 = above(boot) / (n * (1 - lambdas))
+    mse = ((boot_pi0 - pi0.min()) ** 2).mean(axis=0)
+    best = mse.argmin()
+    return min(pi0[best], 1.0), lambdas[best]
+
+# Storey q-values, the smallest false discovery rate at which each test is selected
+def qvalues(pvalues, pi0=1.0):
+    '''
+    pvalues: array of p-values, NaN stay NaN
+    pi0: share of true nulls, 1 gives the Benjamini-Hochberg adjusted p-values
+    '''
+    pvalues = np.asarray(pvalues, dtype=float)
+    q = np.full(pvalues.shape, np.nan)
+    valid = ~np.isnan(pvalues)
+    p = pvalues[valid]
+    order = np.argsort(p)
+    ranked = pi0 * p[order] * len(p) / np.arange(1, len(p) + 1)
+    # step up: every q-value is the smallest ratio at its rank or above
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    q_valid = np.empty(len(p))
+    q_valid[order] = np.minimum(ranked, 1.0)
+    q[valid] = q_valid
+    return q
+
+# Benjamini-Hochberg selection at false discovery rate fdr, Storey's adaptive version when pi0 < 1
+def benjamini_hochberg(pvalues, fdr=0.1, pi0=1.0):
+    return qvalues(pvalues, pi0) <= fdr
+
+# Barras-Scaillet-Wermers shares of zero, positive and negative alpha funds
+def alpha_proportions(tstats, pvalues, pi0, gamma=0.4):
+    '''
+    tstats: array of alpha t-stats
+    pvalues: their two sided p-values
+    pi0: share of zero alpha funds, from storey_pi0
+    gamma: significance level where the lucky funds are netted out, large enough that most skilled funds are significant
+    returns dict of pi0, pi_plus, pi_minus, and the significant shares and false discovery rates at gamma
+    '''
+    tstats = np.asarray(tstats, dtype=float)
+    pvalues = np.asarray(pvalues, dtype=float)
+    valid = ~np.isnan(tstats) & ~np.isnan(pvalues)
+    significant = valid & (pvalues <= gamma)
+    n = valid.sum()
+    share_plus = (significant & (tstats > 0)).sum() / n
+    share_minus = (significant & (tstats < 0)).sum() / n
+    # zero alpha funds are significant with either sign at rate gamma / 2
+    lucky = pi0 * gamma / 2
+    pi_plus = min(max(share_plus - lucky, 0.0), 1 - pi0)
+    pi_minus = min(max(share_minus - lucky, 0.0), 1 - pi0 - pi_plus)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'pi0': pi0,
+            'pi_plus': pi_plus,
+            'pi_minus': pi_minus,
+            'significant_plus': share_plus,
+            'significant_minus': share_minus,
+            'fdr_plus': min(lucky / share_plus, 1.0) if share_plus > 0 else np.nan,
+            'fdr_minus': min(lucky / share_minus, 1.0) if share_minus > 0 else np.nan,
+            'n_tests': int(n),
+        }
+
+# multiple testing selection of out and underperformers over every alpha test in a results df
+def fdr_select(results, column='const', fdr=0.1, gamma=0.4, dof=None, lambdas=STOREY_LAMBDAS, n_boot=1000, seed=0):
+    '''
+    results: df from the batch fits (batch_factor_model, batch_capm_index, ...), one row per fund or fund-window,
+    with column + '_tstat'
+    column: the alpha column tested
+    fdr: false discovery rate of the selection
+    gamma: significance level of the Barras-Scaillet-Wermers proportions
+    dof: degrees of freedom of the t-stats, None for the normal approximation
+    returns dict of proportions (Series) and tests (df of alpha, tstat, pvalue, qvalue and selected, which is
+    1 for a discovered positive alpha, -1 for a negative one and 0 otherwise)
+    '''
+    tstats = results[column + '_tstat'].to_numpy(dtype=float)
+    pvalues = tstat_pvalues(tstats, dof)
+    pi0, lam = storey_pi0(pvalues, lambdas, n_boot, seed)
+    q = qvalues(pvalues, pi0)
+
+    discovered = q <= fdr
+    selected = np.where(discovered, np.sign(tstats), 0).astype(int)
+    proportions = alpha_proportions(tstats, pvalues, pi0, gamma)
+    proportions['lambda'] = lam
+    proportions['n_plus'] = int((selected > 0).sum())
+    proportions['n_minus'] = int((selected < 0).sum())
+
+    tests = pd.DataFrame({
+        'alpha': results[column].to_numpy(dtype=float),
+        'tstat': tstats,
+        'pvalue': pvalues,
+        'qvalue': q,
+        'selected': selected,
+    }, index=results.index)
+    return {'proportions': pd.Series(proportions), 'tests': tests}
@@ -1,25 +1,28 @@
-from tools import get_mutual_fund_data, get_bond_data, get_ff_data, get_index_data
+from tools import load_all
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 import statsmodels.api as sm
 from data_tools import capm, ff_3, ff_5, reg_date_range, capm_index, corr_index
 
-mf_dict = get_mutual_fund_data()
-ff_df = get_ff_data()
-bond_df = get_bond_data()
-index_dict = get_index_data()
+all_data = load_all()
+mf_dict = all_data['mutual_fund']
+ff_df = all_data['ff']
+bond_df = all_data['bond']
+index_dict = all_data['index']
 
-mf_types = list(mf_dict.keys())
-us_eq_data = {k[2]:[] for k in mf_dict.keys() if 'US Equity' in k}
+universe = all_data['universe']
+us_eq_categories = universe.asset_class_categories('US Equity')
 
-for mf_key, mf_val in mf_dict.items():
-    if mf_key[2] in us_eq_data.keys():
-        us_eq_data[mf_key[2]].append(mf_val)
+# funds left out of the analysis
+excluded_funds = universe.fund_ids(['DEEVX'])
 
-for idx, val in enumerate(us_eq_data['Mid-Cap Growth']):
-    if val['ticker'].iloc[0] == 'DEEVX':
-        del us_eq_data['Mid-Cap Growth'][idx]
+mf_types = list(mf_dict.keys())
+us_eq_data = {}
+for category_id in us_eq_categories:
+    fund_ids = np.setdiff1d(universe.category_funds[category_id], excluded_funds)
+    keys = [universe.key(fund_id) for fund_id in fund_ids]
+    us_eq_data[universe.categories[category_id][1]] = [mf_dict[key] for key in keys if key in mf_dict]
 
 us_eq_alphas_c = []
 us_eq_alphas_std_c = []
@@ -37,7 +40,8 @@ for strat in us_eq_data.keys():
     us_eq_alphas_std_c.append(np.std(temp_alpha))
     us_eq_betas_c.append(np.mean(temp_beta))
 
-us_index = {k[2]: v for k, v in index_dict.items() if 'US Equity' in k}
+index_by_ticker = {k[0]: v for k, v in index_dict.items()}
+us_index = {universe.categories[c][1]: index_by_ticker[universe.benchmarks[universe.category_benchmark[c]]] for c in us_eq_categories}
 
 us_idx_alphas_c = []
 us_idx_betas_c = []
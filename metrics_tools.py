@@ -0,0 +1,118 @@
+import pandas as pd
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from panel_tools import align_frame, window_mask
+
+MONTHS_PER_YEAR = 12
+
+# monthly fund returns, risk free rate and active returns against the benchmark, all in decimals
+def metric_inputs(panel, ff_df, bench_panel=None, start_date=None, end_date=None):
+    returns = panel.to_numpy(dtype=float)
+    returns = np.where(window_mask(panel.index, start_date, end_date)[:, None], returns, np.nan)
+    rf = align_frame(ff_df, panel.index)['RF'].to_numpy(dtype=float) / 100
+    active = None
+    if bench_panel is not None:
+        active = returns - bench_panel.to_numpy(dtype=float) / 100
+    return returns, rf, active
+
+# max drawdown and months from the trough back to the previous peak, along axis 0
+def drawdowns(returns):
+    '''
+    returns: array of months x funds (or months x ... ), missing months count as a zero return
+    returns max drawdown (negative decimal) and recovery months (NaN if never recovered)
+    '''
+    wealth = np.cumprod(1 + np.nan_to_num(returns), axis=0)
+    # starting wealth of 1 is the first peak, so a loss in the first month counts
+    peak = np.maximum(np.maximum.accumulate(wealth, axis=0), 1.0)
+    drawdown = wealth / peak - 1
+    max_drawdown = drawdown.min(axis=0)
+
+    trough = drawdown.argmin(axis=0)
+    peak_at_trough = np.take_along_axis(peak, trough[None], axis=0)[0]
+    rows = np.arange(len(returns)).reshape((-1,) + (1,) * (returns.ndim - 1))
+    recovered = (rows > trough) & (wealth >= peak_at_trough)
+    recovery = np.where(recovered.any(axis=0), recovered.argmax(axis=0) - trough, np.nan)
+    recovery = np.where(max_drawdown < 0, recovery, 0.0)
+    return max_drawdown, recovery
+
+# full history metrics of every fund in one vectorized pass over the panel
+def performance_metrics(panel, ff_df, bench_panel=None, start_date=None, end_date=None):
+    '''
+    panel: df from build_panel
+    ff_df: df
+    bench_panel: df from build_benchmark_panel, None to skip information ratio and tracking error
+    returns df indexed by ticker with annualized return, volatility, sharpe, sortino,
+    max drawdown, recovery months, tracking error and information ratio
+    '''
+    returns, rf, active = metric_inputs(panel, ff_df, bench_panel, start_date, end_date)
+    excess = returns - rf[:, None]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n_obs = (~np.isnan(returns)).sum(axis=0)
+        annual_return = np.expm1(np.nanmean(np.log1p(returns), axis=0) * MONTHS_PER_YEAR)
+        volatility = np.nanstd(returns, axis=0, ddof=1) * np.sqrt(MONTHS_PER_YEAR)
+        mean_excess = np.nanmean(excess, axis=0)
+        sharpe = mean_excess / np.nanstd(excess, axis=0, ddof=1) * np.sqrt(MONTHS_PER_YEAR)
+        downside = np.sqrt(np.nanmean(np.minimum(excess, 0) ** 2, axis=0))
+        sortino = mean_excess / downside * np.sqrt(MONTHS_PER_YEAR)
+        max_drawdown, recovery = drawdowns(returns)
+
+        metrics = pd.DataFrame({
+            'n_obs': n_obs,
+            'annual_return': annual_return,
+            'annual_volatility': volatility,
+            'sharpe': sharpe,
+            'sortino': sortino,
+            'max_drawdown': max_drawdown,
+            'recovery_months': recovery,
+        }, index=panel.columns)
+
+        if active is not None:
+            tracking_error = np.nanstd(active, axis=0, ddof=1) * np.sqrt(MONTHS_PER_YEAR)
+            metrics['tracking_error'] = tracking_error
+            metrics['information_ratio'] = np.nanmean(active, axis=0) * MONTHS_PER_YEAR / tracking_error
+    return metrics
+
+# rolling window metrics of every fund, one months x funds df per metric
+def rolling_metrics(panel, ff_df, bench_panel=None, window=36, min_periods=None, block_size=64):
+    '''
+    panel: df from build_panel
+    ff_df: df
+    bench_panel: df from build_benchmark_panel, None to skip information ratio and tracking error
+    window: months per window, each row holds the window ending that month
+    min_periods: observed months needed in a window, defaults to three quarters of it
+    block_size: funds per block of the drawdowns, only windows x window months x block_size are held at once
+    '''
+    if min_periods is None:
+        min_periods = max(window * 3 // 4, 2)
+    returns, rf, active = metric_inputs(panel, ff_df, bench_panel)
+    frame = lambda values: pd.DataFrame(values, index=panel.index, columns=panel.columns)
+    roll = lambda values: frame(values).rolling(window, min_periods=min_periods)
+
+    excess = returns - rf[:, None]
+    excess_roll = roll(excess)
+    mean_excess = excess_roll.mean()
+    metrics = {
+        'annual_return': np.expm1(roll(np.log1p(returns)).mean() * MONTHS_PER_YEAR),
+        'annual_volatility': roll(returns).std() * np.sqrt(MONTHS_PER_YEAR),
+        'sharpe': mean_excess / excess_roll.std() * np.sqrt(MONTHS_PER_YEAR),
+        'sortino': mean_excess / np.sqrt(roll(np.minimum(excess, 0) ** 2).mean()) * np.sqrt(MONTHS_PER_YEAR),
+    }
+
+    # drawdowns of every window of a block of funds at once, windows x window months x block_size
+    max_drawdown = np.full(returns.shape, np.nan)
+    if len(returns) >= window:
+        for start in range(0, returns.shape[1], block_size):
+            block = slice(start, start + block_size)
+            windows = np.moveaxis(sliding_window_view(returns[:, block], window, axis=0), -1, 0)
+            max_drawdown[window - 1:, block] = drawdowns(windows)[0]
+        counts = roll(returns).count().to_numpy()
+        max_drawdown[counts < min_periods] = np.nan
+    metrics['max_drawdown'] = frame(max_drawdown)
+
+    if active is not None:
+        active_roll = roll(active)
+        tracking_error = active_roll.std() * np.sqrt(MONTHS_PER_YEAR)
+        metrics['tracking_error'] = tracking_error
+        metrics['information_ratio'] = active_roll.mean() * MONTHS_PER_YEAR / tracking_error
+    return metrics
@@ -0,0 +1,355 @@
+import pandas as pd
+import numpy as np
+
+
+# build a months x funds panel of one column from the split mutual fund data
+def build_panel(mf_dict, column='nav_return'):
+    '''
+    mf_dict: dict of (ticker, asset_class, category) -> df, as returned by get_mutual_fund_data
+    column: column of each fund df to put in the panel
+    returns df indexed by month end date with one column per ticker, NaN where a month is missing
+    '''
+    # a ticker appearing twice keeps its last fund df, as when the columns were assigned one by one
+    funds = {key[0]: data for key, data in mf_dict.items()}
+    tickers = list(funds)
+    if not funds:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name='date'))
+    dates = [data['date'].to_numpy() for data in funds.values()]
+    values = [data[column].to_numpy(dtype=float) for data in funds.values()]
+
+    # every fund's months in one pass: calendar position, then the last row of any repeated month wins
+    all_dates = np.concatenate(dates)
+    calendar = np.unique(all_dates)
+    rows = np.searchsorted(calendar, all_dates)
+    columns = np.repeat(np.arange(len(tickers)), [len(d) for d in dates])
+    cells = columns * len(calendar) + rows
+    last = len(cells) - 1 - np.unique(cells[::-1], return_index=True)[1]
+
+    panel = np.full((len(calendar), len(tickers)), np.nan)
+    panel[rows[last], columns[last]] = np.concatenate(values)[last]
+    return pd.DataFrame(panel, index=pd.DatetimeIndex(calendar, name='date', freq='infer'), columns=tickers)
+
+# category of every column in a panel
+def panel_categories(mf_dict):
+    return {key[0]: (key[1], key[2]) for key in mf_dict.keys()}
+
+# reindex a dataframe with a date column onto a calendar of month ends
+def align_frame(data, calendar, date_column='date'):
+    data = data.drop_duplicates(date_column, keep='last').set_index(date_column)
+    return data.reindex(calendar)
+
+# build a months x funds panel of the category benchmark return for every fund
+def build_benchmark_panel(panel, categories, index_dict, column='% Change'):
+    '''
+    panel: df from build_panel
+    categories: dict of ticker -> (asset_class, category)
+    index_dict: dict of (ticker, asset_class, category, name) -> df, as returned by get_index_data
+    '''
+    index_by_category = {(key[1], key[2]): data for key, data in index_dict.items()}
+
+    # align every benchmark once, then pick a column per fund
+    aligned = {}
+    for category, data in index_by_category.items():
+        aligned[category] = align_frame(data, panel.index, 'Date')[column].to_numpy(dtype=float)
+
+    bench = np.full(panel.shape, np.nan)
+    for j, ticker in enumerate(panel.columns):
+        category = categories[ticker]
+        if category in aligned:
+            bench[:, j] = aligned[category]
+    return pd.DataFrame(bench, index=panel.index, columns=panel.columns)
+
+# mask of the months inside [start_date, end_date]
+def window_mask(calendar, start_date=None, end_date=None):
+    mask = np.ones(len(calendar), dtype=bool)
+    if start_date is not None:
+        mask &= calendar >= pd.Timestamp(start_date)
+    if end_date is not None:
+        mask &= calendar <= pd.Timestamp(end_date)
+    return mask
+
+# batched OLS with HC0 standard errors, fitting every fund on its own set of months
+def masked_ols(y, x, mask, min_obs=None):
+    '''
+    y: array of months x funds
+    x: array of months x regressors shared by every fund, or months x funds x regressors
+    mask: bool array of months x funds, True where the month is used for that fund
+    min_obs: funds with fewer usable months get NaN results, defaults to regressors + 2
+    returns dict of params, se, tstat (funds x regressors) and n_obs (funds)
+    '''
+    k = x.shape[-1]
+    if min_obs is None:
+        min_obs = k + 2
+
+    # masked entries are zeroed so they drop out of every sum
+    w = mask.astype(float)
+    y = np.where(mask, y, 0.0)
+    if x.ndim == 2:
+        x = np.nan_to_num(x)
+        xtx = np.einsum('tk,tn,tl->nkl', x, w, x)
+        xty = np.einsum('tk,tn->nk', x, y)
+    else:
+        x = np.where(mask[:, :, None], x, 0.0)
+        xtx = np.einsum('tnk,tnl->nkl', x, x)
+        xty = np.einsum('tnk,tn->nk', x, y)
+
+    n_obs = w.sum(axis=0)
+    valid = n_obs >= min_obs
+    # singular systems of dropped funds are swapped for the identity
+    xtx[~valid] = np.eye(k)
+    valid &= np.linalg.matrix_rank(xtx) == k
+    xtx[~valid] = np.eye(k)
+
+    xtx_inv = np.linalg.inv(xtx)
+    params = np.einsum('nkl,nl->nk', xtx_inv, xty)
+
+    if x.ndim == 2:
+        resid = (y - x @ params.T) * w
+        meat = np.einsum('tk,tn,tl->nkl', x, resid ** 2, x)
+    else:
+        resid = (y - np.einsum('tnk,nk->tn', x, params)) * w
+        meat = np.einsum('tnk,tn,tnl->nkl', x, resid ** 2, x)
+    cov = xtx_inv @ meat @ xtx_inv
+    se = np.sqrt(np.einsum('nkk->nk', cov))
+
+    params[~valid] = np.nan
+    se[~valid] = np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tstat = params / se
+    return {'params': params, 'se': se, 'tstat': tstat, 'n_obs': n_obs.astype(int)}
+
+# put masked_ols results into a df indexed by ticker
+def results_frame(fit, names, columns):
+    results = pd.DataFrame(fit['params'], index=columns, columns=names)
+    for i, name in enumerate(names):
+        results[name + '_tstat'] = fit['tstat'][:, i]
+    results['n_obs'] = fit['n_obs']
+    return results
+
+# excess fund returns in percent and usable months of every fund against the factors
+def excess_panel(panel, ff_df, start_date=None, end_date=None):
+    ff = align_frame(ff_df, panel.index)
+    rf = ff['RF'].to_numpy(dtype=float)
+    y = panel.to_numpy(dtype=float) * 100 - rf[:, None]
+    mask = ~np.isnan(y) & window_mask(panel.index, start_date, end_date)[:, None]
+    return y, mask, ff
+
+# excess returns, usable months and the shared design of a constant and the factors, months without
+# every factor are masked out
+def factor_design(panel, ff_df, ff_factors, start_date=None, end_date=None):
+    '''
+    returns y (months x funds), mask (months x funds) and x (months x 1 + factors)
+    '''
+    y, mask, ff = excess_panel(panel, ff_df, start_date, end_date)
+    x = ff[ff_factors].to_numpy(dtype=float)
+    mask &= ~np.isnan(x).any(axis=1)[:, None]
+    return y, mask, np.column_stack([np.ones(len(x)), x])
+
+# excess returns, usable months and the per fund design of a constant and the benchmark excess return,
+# months without a benchmark return are masked out
+def benchmark_design(panel, ff_df, bench_panel, start_date=None, end_date=None):
+    '''
+    returns y (months x funds), mask (months x funds) and x (months x funds x 2)
+    '''
+    y, mask, ff = excess_panel(panel, ff_df, start_date, end_date)
+    rf = ff['RF'].to_numpy(dtype=float)
+    bench = bench_panel.to_numpy(dtype=float) - rf[:, None]
+    mask &= ~np.isnan(bench)
+    return y, mask, np.stack([np.ones_like(bench), bench], axis=2)
+
+# factor sets of the models fitted for every fund, None for the CAPM against the category benchmark
+FACTOR_MODELS = {
+    'capm': ['Mkt-RF'],
+    'ff3': ['Mkt-RF', 'SMB', 'HML'],
+    'ff5': ['Mkt-RF', 'SMB', 'HML', 'RMW', 'CMA'],
+    'bench_capm': None,
+}
+
+# batched factor regression of every fund in the panel, the gap tolerant reg_date_range
+def batch_factor_model(panel, ff_df, ff_factors, start_date=None, end_date=None, min_obs=None):
+    '''
+    panel: df from build_panel
+    ff_df: df
+    ff_factors: list of strings
+    start_date: date in string, None for the full history
+    end_date: date in string, None for the full history
+    '''
+    y, mask, x = factor_design(panel, ff_df, ff_factors, start_date, end_date)
+    fit = masked_ols(y, x, mask, min_obs)
+    return results_frame(fit, ['const'] + list(ff_factors), panel.columns)
+
+# batched CAPM of every fund in the panel
+def batch_capm(panel, ff_df, start_date=None, end_date=None, min_obs=None):
+    return batch_factor_model(panel, ff_df, ['Mkt-RF'], start_date, end_date, min_obs)
+
+# batched CAPM of every fund against its category benchmark, the gap tolerant capm_index
+def batch_capm_index(panel, ff_df, bench_panel, start_date=None, end_date=None, min_obs=None):
+    '''
+    panel: df from build_panel
+    ff_df: df
+    bench_panel: df from build_benchmark_panel
+    '''
+    y, mask, x = benchmark_design(panel, ff_df, bench_panel, start_date, end_date)
+    fit = masked_ols(y, x, mask, min_obs)
+    return results_frame(fit, ['const', 'beta'], panel.columns)
+
+# market timing term of each timing model, from the market excess return
+TIMING_MODELS = {
+    'treynor_mazuy': lambda market: market ** 2,
+    'henriksson_merton': lambda market: np.maximum(0.0, -market),
+}
+
+# batched market timing regression of every fund: excess return on the market and its timing term
+def batch_timing_model(panel, ff_df, model='treynor_mazuy', start_date=None, end_date=None, min_obs=None):
+    '''
+    panel: df from build_panel
+    ff_df: df
+    model: 'treynor_mazuy' (squared market excess return) or 'henriksson_merton' (max(0, -Mkt-RF))
+    returns df indexed by ticker with const (selectivity), beta, timing and their HC0 t-stats
+    '''
+    y, mask, x = factor_design(panel, ff_df, ['Mkt-RF'], start_date, end_date)
+    x = np.column_stack([x, TIMING_MODELS[model](x[:, 1])])
+
+    fit = masked_ols(y, x, mask, min_obs)
+    return results_frame(fit, ['const', 'beta', 'timing'], panel.columns)
+
+# batched market timing regression of every fund against its category benchmark
+def batch_timing_index(panel, ff_df, bench_panel, model='treynor_mazuy', start_date=None, end_date=None, min_obs=None):
+    '''
+    panel: df from build_panel
+    ff_df: df
+    bench_panel: df from build_benchmark_panel
+    model: 'treynor_mazuy' or 'henriksson_merton', the timing term is built from the benchmark excess return
+    '''
+    y, mask, x = benchmark_design(panel, ff_df, bench_panel, start_date, end_date)
+    x = np.concatenate([x, TIMING_MODELS[model](x[:, :, 1:])], axis=2)
+
+    fit = masked_ols(y, x, mask, min_obs)
+    return results_frame(fit, ['const', 'beta', 'timing'], panel.columns)
+
+# correlation of every fund with its category benchmark over shared months, the gap tolerant corr_index
+def batch_corr_index(panel, bench_panel, start_date=None, end_date=None, min_obs=3):
+    y = panel.to_numpy(dtype=float) * 100
+    bench = bench_panel.to_numpy(dtype=float)
+    mask = ~np.isnan(y) & ~np.isnan(bench) & window_mask(panel.index, start_date, end_date)[:, None]
+
+    n = mask.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y = np.where(mask, y, 0.0)
+        bench = np.where(mask, bench, 0.0)
+        y_dev = np.where(mask, y - y.sum(axis=0) / n, 0.0)
+        bench_dev = np.where(mask, bench - bench.sum(axis=0) / n, 0.0)
+        corr = (y_dev * bench_dev).sum(axis=0) / np.sqrt((y_dev ** 2).sum(axis=0) * (bench_dev ** 2).sum(axis=0))
+    corr[n < min_obs] = np.nan
+    return pd.Series(corr, index=panel.columns, name='corr')
+
+# coverage and gap statistics of every fund in one pass over the mask
+def coverage_stats(mask, calendar, columns):
+    '''
+    mask: bool array of months x funds, True where the fund has a usable month
+    calendar: month end dates of the mask rows
+    columns: tickers of the mask columns
+    returns df with first and last month, observed months, coverage of the span, number of gaps and longest gap
+    '''
+    n_months = mask.shape[0]
+    has_data = mask.any(axis=0)
+    rows = np.arange(n_months)
+
+    first = mask.argmax(axis=0)
+    last = n_months - 1 - mask[::-1].argmax(axis=0)
+    n_obs = mask.sum(axis=0)
+    span = np.where(has_data, last - first + 1, 0)
+
+    # a gap starts wherever an observed month is followed by a missing one inside the span
+    inside = (rows[:, None] >= first) & (rows[:, None] <= last)
+    gap_starts = mask[:-1] & ~mask[1:] & inside[1:]
+    n_gaps = gap_starts.sum(axis=0)
+
+    # length of a gap is the distance back to the last observed month
+    last_seen = np.maximum.accumulate(np.where(mask, rows[:, None], -1), axis=0)
+    gap_length = np.where(~mask & inside, rows[:, None] - last_seen, 0)
+    longest_gap = gap_length.max(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        coverage = np.where(span > 0, n_obs / span, np.nan)
+
+    calendar = pd.DatetimeIndex(calendar)
+    return pd.DataFrame({
+        'first_date': calendar[first].where(has_data),
+        'last_date': calendar[last].where(has_data),
+        'n_obs': n_obs,
+        'span': span,
+        'coverage': coverage,
+        'n_gaps': n_gaps,
+        'longest_gap': longest_gap,
+    }, index=columns)
+
+# coverage and gap statistics of every fund in the panel against the factor calendar
+def panel_coverage(panel, ff_df, start_date=None, end_date=None):
+    y, mask, ff = excess_panel(panel, ff_df, start_date, end_date)
+    return coverage_stats(mask, panel.index, panel.columns)
+
+# trailing window OLS of every fund at many dates, from cumulative sums of the masked cross products
+def rolling_masked_ols(y, x, mask, window, rows, min_obs=None, chunk_size=256):
+    '''
+    y: array of months x funds
+    x: array of months x regressors shared by every fund
+    mask: bool array of months x funds, True where the month is used for that fund
+    window: months in each trailing window
+    rows: month positions where a window ends, the window is rows - window + 1 to rows
+    min_obs: funds with fewer usable months in a window get NaN results, defaults to regressors + 2
+    chunk_size: funds whose cumulative sums are held at once
+    returns dict of params, se and tstat (dates x funds x regressors) and n_obs (dates x funds),
+    standard errors are HC0 as in masked_ols
+    '''
+    n_funds = y.shape[1]
+    k = x.shape[1]
+    if min_obs is None:
+        min_obs = k + 2
+    rows = np.asarray(rows)
+    starts = rows - window
+
+    x = np.nan_to_num(x)
+    xx = np.einsum('tk,tl->tkl', x, x)
+    params = np.full((len(rows), n_funds, k), np.nan)
+    se = np.full((len(rows), n_funds, k), np.nan)
+    n_obs = np.zeros((len(rows), n_funds), dtype=int)
+
+    # window sums are differences of cumulative sums, with a zero row in front
+    def window_sums(values):
+        cumulative = np.concatenate([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)])
+        return cumulative[rows + 1] - cumulative[np.maximum(starts + 1, 0)]
+
+    for start in range(0, n_funds, chunk_size):
+        funds = slice(start, start + chunk_size)
+        w = mask[:, funds].astype(float)
+        y_chunk = np.where(mask[:, funds], y[:, funds], 0.0)
+
+        xtx = window_sums(np.einsum('tkl,tn->tnkl', xx, w))
+        xty = window_sums(np.einsum('tk,tn->tnk', x, y_chunk))
+        count = window_sums(w)
+
+        valid = count >= min_obs
+        xtx[~valid] = np.eye(k)
+        valid &= np.linalg.matrix_rank(xtx) == k
+        xtx[~valid] = np.eye(k)
+
+        xtx_inv = np.linalg.inv(xtx)
+        beta = np.einsum('rnkl,rnl->rnk', xtx_inv, xty)
+
+        # the HC0 meat needs the residuals of each window's own fit, one window end at a time
+        for i, (first, last) in enumerate(zip(np.maximum(starts + 1, 0), rows + 1)):
+            x_window = x[first:last]
+            resid = (y_chunk[first:last] - x_window @ beta[i].T) * w[first:last]
+            meat = np.einsum('tk,tn,tl->nkl', x_window, resid ** 2, x_window)
+            cov = xtx_inv[i] @ meat @ xtx_inv[i]
+            se[i, funds] = np.sqrt(np.einsum('nkk->nk', cov))
+
+        beta[~valid] = np.nan
+        params[:, funds] = beta
+        n_obs[:, funds] = count.astype(int)
+
+    se[np.isnan(params)] = np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tstat = params / se
+    return {'params': params, 'se': se, 'tstat': tstat, 'n_obs': n_obs}
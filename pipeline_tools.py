@@ -0,0 +1,326 @@
+import os
+import json
+import pickle
+import hashlib
+import inspect
+import pandas as pd
+import numpy as np
+import tools
+from panel_tools import build_panel, build_benchmark_panel, batch_factor_model, batch_capm_index, FACTOR_MODELS
+
+# directory holding the cached stage outputs and the manifest of their fingerprints
+CACHE_DIR = ".pipeline_cache"
+
+# reason of the planned stages that only recompute if an input stage's output changes
+UPSTREAM_CHANGED = "only if upstream output changes: "
+
+# sha256 of a file's contents
+def file_fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# sha256 of a stage output, stable across runs for equal content
+def content_fingerprint(value):
+    digest = hashlib.sha256()
+
+    def update(value):
+        if isinstance(value, pd.DataFrame):
+            digest.update(repr(list(value.columns)).encode())
+            digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+        elif isinstance(value, pd.Series):
+            digest.update(repr(value.name).encode())
+            digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+        elif isinstance(value, np.ndarray):
+            digest.update(repr((value.dtype, value.shape)).encode())
+            digest.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, dict):
+            for key in sorted(value, key=repr):
+                digest.update(repr(key).encode())
+                update(value[key])
+        elif isinstance(value, (list, tuple)):
+            digest.update(repr(type(value)).encode())
+            for item in value:
+                update(item)
+        else:
+            digest.update(pickle.dumps(value))
+
+    update(value)
+    return digest.hexdigest()
+
+# directory of the project modules, whose source is part of the stage fingerprints
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# sha256 of a module's source for project modules, its version for installed packages
+def module_fingerprint(module):
+    path = inspect.getsourcefile(module) if hasattr(module, "__file__") else None
+    if path is not None and os.path.abspath(path).startswith(PROJECT_DIR + os.sep):
+        return file_fingerprint(path)
+    return repr(getattr(module, "__version__", None))
+
+# fingerprint of a stage function's code, defaults and closure and the source of the modules it calls into,
+# so editing a stage or any project function it uses invalidates it
+def code_fingerprint(func):
+    code = getattr(func, "__code__", None)
+    if code is None:
+        return repr(func)
+    digest = hashlib.sha256()
+    names = set()
+
+    # nested code objects (lambdas, comprehensions) are hashed by content, their repr holds a memory address
+    def update(code):
+        digest.update(code.co_code)
+        digest.update(repr(code.co_names).encode())
+        names.update(code.co_names)
+        for const in code.co_consts:
+            if inspect.iscode(const):
+                update(const)
+            else:
+                digest.update(repr(const).encode())
+
+    update(code)
+    digest.update(repr(func.__defaults__).encode())
+    for cell in func.__closure__ or ():
+        value = cell.cell_contents
+        digest.update((code_fingerprint(value) if inspect.isfunction(value) else repr(value)).encode())
+
+    # modules named by the code directly (tools.read_index_file) or through an imported function or class
+    modules = {}
+    for name in names:
+        value = func.__globals__.get(name)
+        module = value if inspect.ismodule(value) else inspect.getmodule(value) if callable(value) else None
+        if module is not None:
+            modules[module.__name__] = module
+    for name in sorted(modules):
+        digest.update((name + ":" + module_fingerprint(modules[name])).encode())
+    return digest.hexdigest()
+
+# a named step of the pipeline
+class Stage:
+    def __init__(self, name, func, inputs=(), files=()):
+        '''
+        name: unique stage name
+        func: called with the outputs of the input stages, in order
+        inputs: names of upstream stages
+        files: input files whose contents the stage depends on
+        '''
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.files = tuple(files)
+
+    # key of the stage given the output fingerprints of its inputs
+    def key(self, input_fingerprints):
+        parts = [self.name, code_fingerprint(self.func)]
+        parts += [path + ":" + file_fingerprint(path) for path in self.files]
+        parts += [name + ":" + input_fingerprints[name] for name in self.inputs]
+        return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+# DAG of stages that recomputes only what changed since the last run
+class Pipeline:
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.stages = {}
+        self.manifest_path = os.path.join(cache_dir, "manifest.json")
+
+    def add(self, name, func, inputs=(), files=()):
+        for input_name in inputs:
+            if input_name not in self.stages:
+                raise KeyError(f"stage {name} depends on unknown stage {input_name}")
+        self.stages[name] = Stage(name, func, inputs, files)
+        return self.stages[name]
+
+    # stages needed for the targets, in dependency order
+    def order(self, targets=None):
+        if targets is None:
+            return list(self.stages)
+        needed = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending.extend(self.stages[name].inputs)
+        # stages can only depend on stages added before them
+        return [name for name in self.stages if name in needed]
+
+    def load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as file:
+                return json.load(file)
+        return {}
+
+    def save_manifest(self, manifest):
+        with open(self.manifest_path, "w") as file:
+            json.dump(manifest, file, indent=1)
+
+    def output_path(self, name):
+        return os.path.join(self.cache_dir, hashlib.sha256(name.encode()).hexdigest()[:16] + ".pkl")
+
+    # stages that would recompute and why, without running anything
+    def plan(self, targets=None):
+        '''
+        returns dict of stage name -> reason; a stage whose own code, files or cache changed will recompute,
+        a stage below it only recomputes if the output of that stage changes, which run finds out by
+        running it, so its reason starts with UPSTREAM_CHANGED
+        '''
+        manifest = self.load_manifest()
+        # the outputs of the last run are the inputs of every stage as long as nothing upstream changes
+        fingerprints = {name: entry["output"] for name, entry in manifest.items()}
+        dirty = {}
+        for name in self.order(targets):
+            stage = self.stages[name]
+            changed_inputs = [input_name for input_name in stage.inputs if input_name in dirty]
+            if name not in manifest or not os.path.exists(self.output_path(name)):
+                dirty[name] = "not cached"
+            elif all(input_name in fingerprints for input_name in stage.inputs) and \
+                    stage.key(fingerprints) != manifest[name]["key"]:
+                dirty[name] = "input files or code changed"
+            elif changed_inputs:
+                dirty[name] = UPSTREAM_CHANGED + ", ".join(changed_inputs)
+        return dirty
+
+    # print the stages that will recompute and those that only recompute if an upstream output changes
+    def dry_run(self, targets=None):
+        dirty = self.plan(targets)
+        stages = self.order(targets)
+        maybe = [name for name, reason in dirty.items() if reason.startswith(UPSTREAM_CHANGED)]
+        print(f"{len(dirty) - len(maybe)} of {len(stages)} stages will recompute, "
+              f"{len(maybe)} more only if an upstream output changes")
+        for name, reason in dirty.items():
+            print(f"  {name}: {reason}")
+        return dirty
+
+    # run the stages needed for the targets, reusing cached outputs whose key is unchanged
+    def run(self, targets=None, dry_run=False):
+        '''
+        targets: stage names to produce, None for every stage
+        dry_run: only print what would be recomputed
+        returns dict of stage name -> output for the targets
+        '''
+        if dry_run:
+            return self.dry_run(targets)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        manifest = self.load_manifest()
+        fingerprints = {}
+        outputs = {}
+        recomputed = []
+        for name in self.order(targets):
+            stage = self.stages[name]
+            key = stage.key(fingerprints)
+            path = self.output_path(name)
+
+            if name in manifest and manifest[name]["key"] == key and os.path.exists(path):
+                fingerprints[name] = manifest[name]["output"]
+                continue
+
+            # a stage runs only when its key changed, so load the inputs it needs now
+            args = [self.output(input_name, outputs) for input_name in stage.inputs]
+            output = stage.func(*args)
+            with open(path, "wb") as file:
+                pickle.dump(output, file)
+            outputs[name] = output
+            fingerprints[name] = content_fingerprint(output)
+            manifest[name] = {"key": key, "output": fingerprints[name]}
+            self.save_manifest(manifest)
+            recomputed.append(name)
+
+        print(f"Recomputed {len(recomputed)} of {len(self.order(targets))} stages")
+        result_names = list(self.stages) if targets is None else targets
+        return {name: self.output(name, outputs) for name in result_names}
+
+    # output of a stage, from this run or the cache
+    def output(self, name, outputs):
+        if name not in outputs:
+            with open(self.output_path(name), "rb") as file:
+                outputs[name] = pickle.load(file)
+        return outputs[name]
+
+# benchmark index ticker of every category
+def category_benchmarks():
+    return {(asset_class, category): ticker for ticker, (asset_class, category, name) in tools.BENCHMARK_INDEX_CATEGORIES.items()}
+
+# fund panel of one category
+def align_category(mf_dict, asset_class, category):
+    category_funds = {key: data for key, data in mf_dict.items() if key[1] == asset_class and key[2] == category}
+    return build_panel(category_funds)
+
+# benchmark panel of one category
+def align_benchmark(panel, index_data, asset_class, category, benchmark):
+    categories = {ticker: (asset_class, category) for ticker in panel.columns}
+    name = tools.BENCHMARK_INDEX_CATEGORIES[benchmark][2]
+    return build_benchmark_panel(panel, categories, {(benchmark, asset_class, category, name): index_data})
+
+# fit function of one factor model
+def factor_fit(factors):
+    def fit(panel, ff_df):
+        return batch_factor_model(panel, ff_df, factors)
+    fit.__name__ = "fit_" + "_".join(factors)
+    return fit
+
+# mean and standard deviation of the alphas of every model and category
+def aggregate_fits(*fits, names=()):
+    rows = []
+    for (model, category), results in zip(names, fits):
+        alphas = results['const'].dropna()
+        rows.append({'model': model, 'category': category, 'mean_alpha': alphas.mean(), 'std_alpha': alphas.std(ddof=0), 'funds': len(alphas)})
+    return pd.DataFrame(rows)
+
+# bar chart of the mean alpha of every category by model
+def plot_aggregate(summary, path):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    table = summary.pivot(index='category', columns='model', values='mean_alpha')
+    ax = table.plot.bar(figsize=(15, 4), rot=90)
+    ax.set_title('Average alpha of mutual funds')
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+    return path
+
+# the analysis pipeline: load -> clean -> split -> align -> fit per model x category -> aggregate -> plot
+def build_analysis_pipeline(cache_dir=CACHE_DIR, categories=tools.MUTUAL_FUND_CATEGORIES, plot_path="pipeline_alphas.png"):
+    pipeline = Pipeline(cache_dir)
+    fidelity_files = ["data/mutual_funds/category_largest/" + category + ".xlsx" for asset_class, category in tools.MUTUAL_FUND_CATEGORIES]
+
+    pipeline.add("load.universe", tools.get_fund_universe, files=fidelity_files)
+    pipeline.add("load.mutual_fund", tools.read_mutual_fund_data, files=["data/mutual_funds/mutual_fund_data.csv"])
+    pipeline.add("load.ff", tools.get_ff_data, files=["data/F-F_Research_Data_5_Factors_2x3.csv"])
+    benchmarks = category_benchmarks()
+    for benchmark in tools.BENCHMARK_INDEX_CATEGORIES:
+        pipeline.add("load.index." + benchmark, lambda benchmark=benchmark: tools.read_index_file(benchmark),
+                     files=["data/representative_benchmarks/" + benchmark + ".xlsx"])
+
+    pipeline.add("clean.mutual_fund",
+                 lambda data: tools.convert_date_mutual_fund_data(tools.remove_rows_mutual_fund_data(tools.rename_mutual_fund_data(data))),
+                 inputs=["load.mutual_fund"])
+    pipeline.add("split", tools.split_mutual_fund_data, inputs=["clean.mutual_fund", "load.universe"])
+
+    # every category is a partition, so a change in one fund or benchmark only refits its category
+    fit_names = []
+    for asset_class, category in categories:
+        benchmark = benchmarks[(asset_class, category)]
+        align = "align." + category
+        pipeline.add(align, lambda mf_dict, a=asset_class, c=category: align_category(mf_dict, a, c), inputs=["split"])
+        pipeline.add("align.bench." + category,
+                     lambda panel, index_data, a=asset_class, c=category, b=benchmark: align_benchmark(panel, index_data, a, c, b),
+                     inputs=[align, "load.index." + benchmark])
+
+        for model, factors in FACTOR_MODELS.items():
+            name = "fit." + model + "." + category
+            if factors is None:
+                pipeline.add(name, lambda panel, bench, ff_df: batch_capm_index(panel, ff_df, bench),
+                             inputs=[align, "align.bench." + category, "load.ff"])
+            else:
+                pipeline.add(name, factor_fit(factors), inputs=[align, "load.ff"])
+            fit_names.append((name, (model, category)))
+
+    pipeline.add("aggregate", lambda *fits: aggregate_fits(*fits, names=[names for name, names in fit_names]),
+                 inputs=[name for name, names in fit_names])
+    pipeline.add("plot", lambda summary: plot_aggregate(summary, plot_path), inputs=["aggregate"])
+    return pipeline
@@ -0,0 +1,108 @@
+import polars as pl
+import pandas as pd
+import numpy as np
+import tools
+
+# the lazy loaders of the "polars" backend: every read -> rename -> filter -> date-convert -> split
+# step runs in the polars engine and frames become pandas only when they are returned
+
+# month end datetime from a date string column, matching the pandas loaders
+def month_end(column, format):
+    return pl.col(column).str.to_date(format).dt.month_end().cast(pl.Datetime('ns'))
+
+# lazy scan of the cleaned mutual fund data, sorted by ticker and date with the nav returns added
+def scan_mutual_fund_data(tickers=None):
+    '''
+    tickers: only keep these tickers, the filter is pushed down into the csv scan
+    '''
+    data = pl.scan_csv(
+        "data/mutual_funds/mutual_fund_data.csv",
+        schema_overrides={'ticker': pl.String, 'crsp_fundno': pl.String, 'caldt': pl.String,
+                          'mtna': pl.Float64, 'mret': pl.String, 'mnav': pl.Float64},
+    )
+    data = data.drop_nulls().rename(tools.MUTUAL_FUND_COLUMNS).drop('crsp_fundno')
+    if tickers is not None:
+        data = data.filter(pl.col('ticker').is_in(list(tickers)))
+
+    # remove rows with 'R' in total_returns
+    data = data.filter(pl.col('total_returns') != 'R')
+    data = data.with_columns(date=month_end('date', '%Y-%m-%d'), total_returns=pl.col('total_returns').cast(pl.Float64))
+    data = data.sort(['ticker', 'date'], maintain_order=True)
+
+    # tickers with less than 5 years of data get no nav returns and are dropped at the split
+    data = data.with_columns(months=pl.len().over('ticker'))
+    return data.with_columns(nav_return=pl.col('net_asset_value').pct_change().over('ticker'))
+
+# collect the cleaned mutual fund data on all cores
+def clean_mutual_fund_data(tickers=None, budget=None):
+    data = scan_mutual_fund_data(tickers).collect()
+    if budget is not None:
+        budget.check("clean", data)
+    return data
+
+# split collected mutual fund data by ticker into pandas frames, for every fund of the universe
+def split_mutual_fund_data(data, universe, budget=None):
+    months = dict(data.group_by('ticker').agg(pl.len()).iter_rows())
+
+    # one conversion to pandas, then every ticker is a contiguous slice of the sorted frame
+    # the collected polars frame stays alive with its caller while the pandas frames are built
+    # the split frames are views of the converted frame, so this is also the peak of the split
+    frame = data.filter(pl.col('months') >= 60).drop('months').to_pandas()
+    if budget is not None:
+        budget.check("convert", data, frame)
+    tickers, starts, counts = np.unique(frame['ticker'].to_numpy(dtype=str), return_index=True, return_counts=True)
+    slices = {ticker: (start, start + count) for ticker, start, count in zip(tickers, starts, counts)}
+
+    split_data = {}
+    n_empty = 0
+    n_young = 0
+    for fund_id in range(len(universe)):
+        ticker, asset_class, category = universe.key(fund_id)
+        if ticker not in months:
+            n_empty += 1
+        elif months[ticker] < 60:
+            n_young += 1
+        else:
+            start, end = slices[ticker]
+            split_data[(ticker, asset_class, category)] = frame.iloc[start:end].reset_index(drop=True)
+
+    tools.print_split_summary(split_data, n_empty, n_young)
+    return split_data
+
+# get and process mutual fund data with the polars engine
+def polars_mutual_fund_data(universe, budget=None):
+    return split_mutual_fund_data(clean_mutual_fund_data(universe.tickers, budget), universe, budget)
+
+# get bond data with the polars engine
+def polars_bond_data():
+    data = pl.scan_csv("data/bond_data.csv", schema_overrides={'caldt': pl.String}).drop_nulls()
+    data = data.rename(tools.BOND_COLUMNS).with_columns(date=month_end('date', '%Y-%m-%d'))
+    return data.collect().to_pandas()
+
+# get fama french data with the polars engine
+def polars_ff_data():
+    data = pl.scan_csv("data/F-F_Research_Data_5_Factors_2x3.csv", schema_overrides={'': pl.String})
+    data = data.rename({'': 'date'}).with_columns(date=month_end('date', '%Y%m'))
+    return data.collect().to_pandas()
+
+# assert the pandas and polars backends load the same data
+def check_backend_parity(universe=None):
+    '''
+    universe: FundUniverse, built from the fidelity files if None
+    raises AssertionError on the first difference, both backends return total_returns as floats
+    '''
+    if universe is None:
+        universe = tools.get_fund_universe()
+
+    for loader in (tools.get_bond_data, tools.get_ff_data):
+        expected = loader(backend="pandas")
+        actual = loader(backend="polars")
+        pd.testing.assert_frame_equal(expected.reset_index(drop=True), actual, check_dtype=False)
+
+    expected = tools.get_mutual_fund_data(universe, backend="pandas")
+    actual = tools.get_mutual_fund_data(universe, backend="polars")
+    assert list(expected) == list(actual), "different funds"
+    for key, expected_data in expected.items():
+        assert expected_data['total_returns'].dtype == actual[key]['total_returns'].dtype, f"{key} total_returns dtype"
+        pd.testing.assert_frame_equal(expected_data, actual[key], check_dtype=False, obj=str(key))
+    return True
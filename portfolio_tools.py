@@ -0,0 +1,182 @@
+import pandas as pd
+import numpy as np
+from panel_tools import excess_panel, batch_factor_model
+
+# factors used for the ex-ante exposures of the portfolios
+FF5_FACTORS = ['Mkt-RF', 'SMB', 'HML', 'RMW', 'CMA']
+
+# funds with a positive value of a result column, e.g. the alpha of batch_factor_model
+def positive_alpha_funds(results, column='const'):
+    return list(results.index[results[column] > 0])
+
+# ledoit-wolf shrinkage of the covariance of excess returns towards a scaled identity
+def ledoit_wolf_cov(x, mask, block_size=256):
+    '''
+    x: array of months x funds
+    mask: bool array of months x funds, True where the month is observed
+    block_size: funds per block, only months x block_size products are held at once
+    returns the shrunk covariance (funds x funds) and the shrinkage intensity
+    uses every pair of funds over the months they share
+    '''
+    n_funds = x.shape[1]
+    w = mask.astype(float)
+    n_obs = w.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(mask, x, 0.0).sum(axis=0) / n_obs
+    x = np.where(mask, x - means, 0.0)
+    x2 = x ** 2
+
+    cov = np.empty((n_funds, n_funds))
+    pi_sum = 0.0
+    for start in range(0, n_funds, block_size):
+        block = slice(start, start + block_size)
+        n_pair = np.maximum(w.T @ w[:, block], 1.0)
+        cov_block = (x.T @ x[:, block]) / n_pair
+        # variance of every sample covariance entry, summed for the shrinkage intensity
+        pi_sum += ((x2.T @ x2[:, block] / n_pair - cov_block ** 2) / n_pair).sum()
+        cov[:, block] = cov_block
+
+    mu = np.trace(cov) / n_funds
+    delta = ((cov - mu * np.eye(n_funds)) ** 2).sum() / n_funds
+    beta = min(pi_sum / n_funds, delta)
+    shrinkage = beta / delta if delta > 0 else 1.0
+
+    shrunk = (1 - shrinkage) * cov + shrinkage * mu * np.eye(n_funds)
+    # pairwise estimates can leave tiny negative eigenvalues, clip them
+    eigenvalues, eigenvectors = np.linalg.eigh(shrunk)
+    eigenvalues = np.maximum(eigenvalues, 1e-8 * max(mu, 1e-12))
+    shrunk = (eigenvectors * eigenvalues) @ eigenvectors.T
+    return shrunk, shrinkage
+
+# project every row onto the long-only simplex (weights >= 0 summing to 1)
+def project_simplex(v):
+    u = -np.sort(-v, axis=1)
+    css = np.cumsum(u, axis=1) - 1
+    index = np.arange(1, v.shape[1] + 1)
+    rho = (u - css / index > 0).sum(axis=1) - 1
+    theta = css[np.arange(len(v)), rho] / (rho + 1)
+    return np.maximum(v - theta[:, None], 0.0)
+
+# project every row onto the long-only weights with a'w = 1, a may have any sign
+def project_budget(v, a):
+    '''
+    v: array of rows to project
+    a: array (funds), the projection is w = max(v - theta a, 0) with theta solving a'w = 1
+    a'w is piecewise linear and decreasing in theta, so theta is found on the segment between
+    the sorted breakpoints v / a where it crosses 1
+    '''
+    n_rows, n_funds = v.shape
+    with np.errstate(divide='ignore', invalid='ignore'):
+        breakpoints = np.where(a != 0, v / a, np.inf)
+    order = np.argsort(breakpoints, axis=1)
+    b = np.take_along_axis(breakpoints, order, axis=1)
+    a_sorted = a[order]
+    av = a_sorted * np.take_along_axis(v, order, axis=1)
+    a2 = a_sorted ** 2
+
+    # on segment s (between breakpoints s - 1 and s) the funds with a > 0 after it and a < 0 before it are active
+    def active_sum(x):
+        head = np.concatenate([np.zeros((n_rows, 1)), np.cumsum(np.where(a_sorted < 0, x, 0.0), axis=1)], axis=1)
+        tail = np.concatenate([np.zeros((n_rows, 1)), np.cumsum(np.where(a_sorted > 0, x, 0.0), axis=1)], axis=1)
+        return head + tail[:, -1:] - tail
+    slope = active_sum(a2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        theta = (active_sum(av) - 1) / slope
+    left = np.concatenate([np.full((n_rows, 1), -np.inf), b], axis=1)
+    right = np.concatenate([b, np.full((n_rows, 1), np.inf)], axis=1)
+    valid = (slope > 0) & (theta >= left) & (theta <= right)
+    theta = theta[np.arange(n_rows), valid.argmax(axis=1)]
+    return np.maximum(v - theta[:, None] * a, 0.0)
+
+# accelerated projected gradient of a quadratic, every row stepping together
+def projected_gradient(gradient, project, w, step, max_iter=2000, tol=1e-10):
+    z = w
+    t = 1.0
+    for i in range(max_iter):
+        w_next = project(z - step * gradient(z))
+        t_next = (1 + np.sqrt(1 + 4 * t ** 2)) / 2
+        z = w_next + ((t - 1) / t_next) * (w_next - w)
+        converged = np.abs(w_next - w).max() < tol
+        w, t = w_next, t_next
+        if converged:
+            break
+    return w
+
+# long-only mean-variance portfolios for many risk aversions in one batched solve
+def mean_variance_weights(mu, cov, risk_tolerance, max_iter=2000, tol=1e-10):
+    '''
+    mu: expected excess returns (funds)
+    cov: covariance (funds x funds)
+    risk_tolerance: array of points, each solving min w'cov w - t mu'w with w >= 0 and sum w = 1
+    returns weights (points x funds)
+    '''
+    risk_tolerance = np.asarray(risk_tolerance, dtype=float)
+    n_funds = len(mu)
+    step = 1.0 / (2 * np.linalg.eigvalsh(cov)[-1])
+    w = np.full((len(risk_tolerance), n_funds), 1.0 / n_funds)
+    gradient = lambda z: 2 * z @ cov - risk_tolerance[:, None] * mu
+    return projected_gradient(gradient, project_simplex, w, step, max_iter, tol)
+
+# long-only max sharpe portfolio, min w'cov w with mu'w = 1 and w >= 0 rescaled to sum to 1
+def max_sharpe_weights(mu, cov, max_iter=2000, tol=1e-10):
+    '''
+    mu: expected excess returns (funds)
+    cov: covariance (funds x funds)
+    returns weights (funds), NaN if no fund has a positive expected excess return
+    '''
+    if not (mu > 0).any():
+        return np.full(len(mu), np.nan)
+    # mu'w = 1 sets the scale of w, so the tolerance is relative to the starting point
+    step = 1.0 / (2 * np.linalg.eigvalsh(cov)[-1])
+    w = project_budget(np.full((1, len(mu)), 1.0 / len(mu)), mu)
+    tol = tol * np.abs(w).sum()
+    w = projected_gradient(lambda z: 2 * z @ cov, lambda v: project_budget(v, mu), w, step, max_iter, tol)[0]
+    return w / w.sum()
+
+# efficient frontier and max sharpe portfolio over a set of funds
+def optimize_portfolios(panel, ff_df, tickers, start_date=None, end_date=None, n_points=50, factors=FF5_FACTORS, block_size=256):
+    '''
+    panel: df from build_panel
+    ff_df: df
+    tickers: funds to invest in, e.g. from positive_alpha_funds
+    start_date: date in string, None for the full history
+    end_date: date in string, None for the full history
+    n_points: number of frontier points solved together
+    returns dict of frontier (return, volatility, sharpe per point), weights (points x tickers),
+    max_sharpe (weights), exposures (alpha and factor betas per point) and shrinkage
+    returns and volatilities are monthly excess returns in percent
+    funds the factor model cannot fit over the window are left out of the investable set
+    '''
+    panel = panel[list(tickers)]
+    fund_results = batch_factor_model(panel, ff_df, list(factors), start_date, end_date)
+    loadings = fund_results[['const'] + list(factors)]
+    fitted = loadings.notna().all(axis=1).to_numpy()
+    panel = panel.loc[:, fitted]
+    loadings = loadings[fitted].to_numpy()
+    y, mask, ff = excess_panel(panel, ff_df, start_date, end_date)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mu = np.where(mask, y, 0.0).sum(axis=0) / mask.sum(axis=0)
+    cov, shrinkage = ledoit_wolf_cov(y, mask, block_size)
+
+    # risk tolerances from the minimum variance portfolio up to the highest mean fund
+    scale = 2 * np.linalg.eigvalsh(cov)[-1] / max(np.ptp(mu), 1e-12)
+    risk_tolerance = np.concatenate([[0.0], np.geomspace(1e-3, 1e2, n_points - 1)]) * scale
+    weights = mean_variance_weights(mu, cov, risk_tolerance)
+
+    returns = weights @ mu
+    volatility = np.sqrt(np.einsum('pi,ij,pj->p', weights, cov, weights))
+    sharpe = returns / volatility
+    frontier = pd.DataFrame({'risk_tolerance': risk_tolerance, 'return': returns, 'volatility': volatility, 'sharpe': sharpe})
+    weights = pd.DataFrame(weights, columns=panel.columns)
+
+    # ex-ante exposures are the weighted fund alphas and betas
+    exposures = pd.DataFrame(weights.to_numpy() @ loadings, columns=['const'] + list(factors))
+
+    return {
+        'frontier': frontier,
+        'weights': weights,
+        'max_sharpe': pd.Series(max_sharpe_weights(mu, cov), index=panel.columns),
+        'exposures': exposures,
+        'shrinkage': shrinkage,
+    }
@@ -0,0 +1,182 @@
+import threading
+from collections import Counter
+import pandas as pd
+import numpy as np
+from panel_tools import batch_factor_model, batch_capm_index, FACTOR_MODELS
+
+# order of the funds where every prefix is a stratified random sample of the categories
+def stratified_order(categories, seed=0, per_category=0):
+    '''
+    categories: dict of ticker -> (asset_class, category), as returned by panel_categories
+    per_category: funds of each category placed first, all of a category's funds if it has fewer
+    returns array of tickers, the first per_category funds of every category and then the rest of each
+    category spread evenly through the order, in random order
+    '''
+    rng = np.random.default_rng(seed)
+    tickers = np.array(list(categories.keys()))
+    groups = pd.Series([categories[ticker] for ticker in tickers]).factorize()[0]
+
+    # the i-th of n shuffled funds of a category sits at (i + u) / n, so a prefix holds every category in proportion;
+    # the first per_category funds and the rest of a category are spread this way separately
+    position = np.empty(len(tickers))
+    seeded = np.empty(len(tickers), dtype=bool)
+    for group in range(groups.max() + 1):
+        members = np.flatnonzero(groups == group)
+        rank = rng.permutation(len(members))
+        n_seed = min(per_category, len(members))
+        in_seed = rank < n_seed
+        part_rank = np.where(in_seed, rank, rank - n_seed)
+        part_size = np.where(in_seed, n_seed, len(members) - n_seed)
+        position[members] = (part_rank + rng.random(len(members))) / part_size
+        seeded[members] = in_seed
+    return tickers[np.lexsort((position, ~seeded))]
+
+# category means and one sigma bands of a result column, with bootstrap confidence intervals
+def category_stats(results, categories, column='const', n_boot=200, ci=0.95, seed=0):
+    '''
+    results: df from the batch fits indexed by ticker
+    categories: dict of ticker -> (asset_class, category)
+    returns df indexed by category with funds, mean, std (the sigma band is mean +- std),
+    band_low and band_high and the bootstrap confidence bounds of the mean and std
+    '''
+    rng = np.random.default_rng(seed)
+    values = results[column].dropna()
+    category = pd.Series([categories[ticker][1] for ticker in values.index], index=values.index)
+    bounds = [(1 - ci) / 2 * 100, (1 + ci) / 2 * 100]
+
+    rows = {}
+    for name, members in values.groupby(category):
+        x = members.to_numpy(dtype=float)
+        # every bootstrap sample of the category at once
+        boot = x[rng.integers(0, len(x), size=(n_boot, len(x)))]
+        mean_low, mean_high = np.percentile(boot.mean(axis=1), bounds)
+        std_low, std_high = np.percentile(boot.std(axis=1), bounds)
+        mean, std = x.mean(), x.std()
+        rows[name] = {
+            'funds': len(x),
+            'mean': mean,
+            'std': std,
+            'band_low': mean - std,
+            'band_high': mean + std,
+            'mean_low': mean_low,
+            'mean_high': mean_high,
+            'std_low': std_low,
+            'std_high': std_high,
+        }
+    stats = pd.DataFrame.from_dict(rows, orient='index')
+    stats.index.name = 'category'
+    return stats
+
+# fit function of one model over a list of tickers
+def preview_fit(panel, ff_df, model='capm', bench_panel=None):
+    factors = FACTOR_MODELS[model]
+    if factors is None:
+        return lambda tickers: batch_capm_index(panel[tickers], ff_df, bench_panel[tickers])
+    return lambda tickers: batch_factor_model(panel[tickers], ff_df, factors)
+
+# fits a stratified sample first, then refines to every fund in the background
+class PreviewAnalysis:
+    def __init__(self, fit, categories, column='const', per_category=5, growth=2.0, n_boot=200, seed=0, on_update=None):
+        '''
+        fit: function of a list of tickers returning a results df indexed by ticker, e.g. from preview_fit
+        categories: dict of ticker -> (asset_class, category), as returned by panel_categories
+        column: result column summarized by category
+        per_category: funds of each category in the first preview
+        growth: each background batch is this many times the funds fitted so far
+        on_update: called with the summary df and the fitted share after every batch
+        '''
+        self.fit = fit
+        self.categories = categories
+        self.column = column
+        self.order = stratified_order(categories, seed, per_category)
+        self.first_batch = sum(min(count, per_category) for count in Counter(categories.values()).values())
+        self.growth = growth
+        self.n_boot = n_boot
+        self.seed = seed
+        self.on_update = on_update
+
+        self.results = []
+        self.n_fitted = 0
+        self.summary = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.error = None
+
+    # share of the funds fitted so far
+    @property
+    def progress(self):
+        return self.n_fitted / len(self.order)
+
+    @property
+    def done(self):
+        return self.n_fitted == len(self.order)
+
+    # fit the next batch of the order and refresh the summary
+    def step(self, size):
+        tickers = list(self.order[self.n_fitted:self.n_fitted + size])
+        results = self.fit(tickers)
+        with self.lock:
+            self.results.append(results)
+            self.n_fitted += len(tickers)
+            summary = category_stats(pd.concat(self.results), self.categories, self.column, self.n_boot, seed=self.seed)
+            self.summary = summary
+            progress = self.progress
+        if self.on_update is not None:
+            self.on_update(summary, progress)
+        return summary
+
+    # fit the first stratified sample and return its summary
+    def preview(self):
+        if self.n_fitted == 0:
+            self.step(self.first_batch)
+        return self.summary
+
+    def refine(self):
+        try:
+            while not self.done and not self.stop_event.is_set():
+                self.step(max(int(self.n_fitted * (self.growth - 1)), 1))
+        except Exception as error:
+            self.error = error
+
+    # preview now, then keep refining in a background thread
+    def start(self):
+        summary = self.preview()
+        if self.thread is None and not self.done:
+            self.thread = threading.Thread(target=self.refine, daemon=True)
+            self.thread.start()
+        return summary
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    # block until every fund is fitted, returns the full universe summary
+    def wait(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.summary
+
+    # fitted results so far, one row per ticker
+    def fitted(self):
+        with self.lock:
+            return pd.concat(self.results) if self.results else None
+
+# mean alpha of every category with its confidence interval and sigma band
+def plot_preview(summary, ax=None, title='Average alpha of mutual funds'):
+    import matplotlib.pyplot as plt
+
+    if ax is None:
+        fig, ax = plt.subplots(figsize=(15, 4))
+    positions = np.arange(len(summary))
+    ax.fill_between(positions, summary['band_low'], summary['band_high'], color='r', alpha=0.2, label='1 stdev band')
+    errors = [summary['mean'] - summary['mean_low'], summary['mean_high'] - summary['mean']]
+    ax.errorbar(positions, summary['mean'], yerr=errors, fmt='o', capsize=3, label='mean')
+    ax.set_xticks(positions)
+    ax.set_xticklabels(summary.index, rotation=90)
+    ax.set_title(f"{title} ({summary['funds'].sum()} funds)")
+    ax.legend()
+    return ax
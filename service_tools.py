@@ -0,0 +1,182 @@
+import json
+import threading
+import argparse
+import urllib.request
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pandas as pd
+import numpy as np
+from panel_tools import (build_panel, panel_categories, build_benchmark_panel, batch_factor_model, batch_capm_index,
+                         batch_corr_index, FACTOR_MODELS)
+
+# default address of the local query service
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+
+# number of query results kept in the cache
+CACHE_SIZE = 100000
+
+# models the service answers: the factor models and the correlation with the category benchmark
+SERVICE_MODELS = {**FACTOR_MODELS, 'corr': None}
+
+# NaN is not valid json, send it as null
+def json_value(value):
+    value = float(value)
+    return None if np.isnan(value) else value
+
+# start or end date of a query, None if not given
+def query_date(value):
+    if value is None:
+        return None
+    # a json number would be read as nanoseconds since 1970
+    if not isinstance(value, str):
+        raise ValueError(f"date {value!r} is not a string")
+    date = pd.Timestamp(value)
+    if pd.isna(date):
+        raise ValueError(f"date {value!r} is not a date")
+    return date
+
+# holds the aligned panel, factors and benchmarks in memory and answers model x ticker x window queries
+class AlphaService:
+    def __init__(self, mf_dict, ff_df, index_dict, cache_size=CACHE_SIZE):
+        self.panel = build_panel(mf_dict)
+        self.bench_panel = build_benchmark_panel(self.panel, panel_categories(mf_dict), index_dict)
+        self.ff_df = ff_df
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+
+    # load every source once with load_all
+    @classmethod
+    def from_files(cls, use_processes=None):
+        from tools import load_all
+        data = load_all(use_processes)
+        return cls(data['mutual_fund'], data['ff'], data['index'])
+
+    # fit one model for a group of tickers over one window in a single batch
+    def fit(self, model, tickers, start_date, end_date):
+        panel = self.panel[tickers]
+        if model == 'corr':
+            corr = batch_corr_index(panel, self.bench_panel[tickers], start_date, end_date)
+            return {ticker: {'corr': json_value(corr[ticker])} for ticker in tickers}
+        if model == 'bench_capm':
+            results = batch_capm_index(panel, self.ff_df, self.bench_panel[tickers], start_date, end_date)
+        else:
+            results = batch_factor_model(panel, self.ff_df, SERVICE_MODELS[model], start_date, end_date)
+        return {ticker: {column: json_value(value) for column, value in row.items()} for ticker, row in results.iterrows()}
+
+    # answer a list of queries, batching the uncached ones by model and window
+    def query(self, queries):
+        '''
+        queries: list of dicts with model, ticker and optional start and end date strings
+        returns one result dict per query, with an error key for invalid queries
+        '''
+        answers = [None] * len(queries)
+        groups = {}
+        for i, query in enumerate(queries):
+            model, ticker = query.get('model'), query.get('ticker')
+            try:
+                start_date, end_date = query_date(query.get('start')), query_date(query.get('end'))
+            except ValueError as error:
+                answers[i] = {'error': str(error)}
+                continue
+            if model not in SERVICE_MODELS:
+                answers[i] = {'error': f"unknown model {model}"}
+            elif ticker not in self.panel.columns:
+                answers[i] = {'error': f"unknown ticker {ticker}"}
+            else:
+                # parsed dates, so spellings of the same window share the cache
+                key = (model, ticker, start_date, end_date)
+                with self.lock:
+                    cached = self.cache.get(key)
+                    if cached is not None:
+                        self.cache.move_to_end(key)
+                if cached is not None:
+                    answers[i] = cached
+                else:
+                    groups.setdefault(key[0:1] + key[2:], []).append((i, key))
+
+        for (model, start_date, end_date), members in groups.items():
+            tickers = list(dict.fromkeys(key[1] for i, key in members))
+            results = self.fit(model, tickers, start_date, end_date)
+            with self.lock:
+                for i, key in members:
+                    answers[i] = results[key[1]]
+                    self.cache[key] = answers[i]
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return answers
+
+# http handler, POST /query with a json list of queries
+class AlphaHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def send_json(self, status, body):
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {'funds': len(self.service.panel.columns), 'cached': len(self.service.cache)})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != "/query":
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            queries = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            self.send_json(200, self.service.query(queries))
+        except (ValueError, TypeError, AttributeError) as error:
+            self.send_json(400, {'error': str(error)})
+        except Exception as error:
+            self.send_json(500, {'error': repr(error)})
+
+    # keep notebook output quiet
+    def log_message(self, format, *args):
+        pass
+
+# start the service and block until interrupted
+def serve(service, host=SERVICE_HOST, port=SERVICE_PORT):
+    handler = type("BoundAlphaHandler", (AlphaHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Alpha service on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return server
+
+# small client for the notebooks
+class AlphaClient:
+    def __init__(self, host=SERVICE_HOST, port=SERVICE_PORT, timeout=30):
+        self.url = f"http://{host}:{port}"
+        self.timeout = timeout
+
+    def query_many(self, queries):
+        request = urllib.request.Request(self.url + "/query", data=json.dumps(queries).encode(),
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    # e.g. client.query('ff5', 'FCNTX', '2010-01-01', '2020-12-31')['const']
+    def query(self, model, ticker, start_date=None, end_date=None):
+        return self.query_many([{'model': model, 'ticker': ticker, 'start': start_date, 'end': end_date}])[0]
+
+    def health(self):
+        with urllib.request.urlopen(self.url + "/health", timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local alpha query service")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    args = parser.parse_args()
+    serve(AlphaService.from_files(), args.host, args.port)
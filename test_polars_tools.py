@@ -0,0 +1,25 @@
+import os
+import pytest
+
+pytest.importorskip("polars")
+
+import tools
+import polars_tools
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# the loaders read the data directory relative to the repository
+@pytest.fixture
+def in_repo(monkeypatch):
+    for path in ("data/mutual_funds/mutual_fund_data.csv", "data/bond_data.csv", "data/F-F_Research_Data_5_Factors_2x3.csv"):
+        if not os.path.exists(os.path.join(REPO_DIR, path)):
+            pytest.skip(f"{path} is not available")
+    monkeypatch.chdir(REPO_DIR)
+
+def test_backend_parity(in_repo):
+    assert polars_tools.check_backend_parity()
+
+def test_load_all_backend_parity(in_repo):
+    expected = tools.load_all(backend="pandas")["mutual_fund"]
+    actual = tools.load_all(backend="polars")["mutual_fund"]
+    assert list(expected) == list(actual)
@@ -1,31 +1,33 @@
+import os
+import multiprocessing
 import pandas as pd
-
-# tickers of largest largest active mutual fund by AUM for each morningstar category
-MUTUAL_FUND_CATEGORIES= {
-    ("US Equity", "Large Value"): [],
-    ("US Equity", "Large Blend"): [],
-    ("US Equity", "Large Growth"): [],
-    ("US Equity", "Mid-Cap Value"): [],
-    ("US Equity", "Mid-Cap Blend"): [],
-    ("US Equity", "Mid-Cap Growth"): [],
-    ("US Equity", "Small Value"): [],
-    ("US Equity", "Small Blend"): [],
-    ("US Equity", "Small Growth"): [],
-    ("International Equity", "Foreign Large Value"): [],
-    ("International Equity", "Foreign Large Blend"): [],
-    ("International Equity", "Foreign Large Growth"): [],
-    ("International Equity", "Foreign SmallMid Value"): [],
-    ("International Equity", "Foreign SmallMid Blend"): [],
-    ("International Equity", "Foreign SmallMid Growth"): [],
-    ("International Equity", "Diversified Emerging Mkts"): [],
-    ("US Fixed Income", "Long-Term Bond"): [],
-    ("US Fixed Income", "Intermediate Core Bond"): [],
-    ("US Fixed Income", "Intermediate Core-Plus Bond"): [],
-    ("US Fixed Income", "Short-Term Bond"): [],
-}
-
-# reversed dictionary so that tickers are keys and categories are values
-MUTUAL_FUND_TICKERS = {}
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from universe_tools import FundUniverse, fidelity_ticker
+
+# morningstar categories of the largest active mutual funds by AUM, in category id order
+MUTUAL_FUND_CATEGORIES = (
+    ("US Equity", "Large Value"),
+    ("US Equity", "Large Blend"),
+    ("US Equity", "Large Growth"),
+    ("US Equity", "Mid-Cap Value"),
+    ("US Equity", "Mid-Cap Blend"),
+    ("US Equity", "Mid-Cap Growth"),
+    ("US Equity", "Small Value"),
+    ("US Equity", "Small Blend"),
+    ("US Equity", "Small Growth"),
+    ("International Equity", "Foreign Large Value"),
+    ("International Equity", "Foreign Large Blend"),
+    ("International Equity", "Foreign Large Growth"),
+    ("International Equity", "Foreign SmallMid Value"),
+    ("International Equity", "Foreign SmallMid Blend"),
+    ("International Equity", "Foreign SmallMid Growth"),
+    ("International Equity", "Diversified Emerging Mkts"),
+    ("US Fixed Income", "Long-Term Bond"),
+    ("US Fixed Income", "Intermediate Core Bond"),
+    ("US Fixed Income", "Intermediate Core-Plus Bond"),
+    ("US Fixed Income", "Short-Term Bond"),
+)
 
 # convert benchmark index ticker to morningstar category
 BENCHMARK_INDEX_CATEGORIES = {
@@ -55,15 +57,127 @@ BENCHMARK_INDEX_CATEGORIES = {
 pd.set_option('display.max_columns', None)
 pd.set_option('expand_frame_repr', False)
 
+# the chained loader stages share columns instead of copying them under copy-on-write, which is
+# always on from pandas 3. on older pandas it is left to the caller, pd.set_option('mode.copy_on_write', True)
+# before loading, as the option is global and flipping it here would change every other user of pandas
+
+# dataframe engine of the loaders, "pandas" or the lazy "polars" engine in polars_tools
+LOADER_BACKEND = "pandas"
+LOADER_BACKENDS = ("pandas", "polars")
+
+# column names of the WRDS mutual fund extract
+MUTUAL_FUND_COLUMNS = {
+    "caldt": "date",
+    "mtna": "total_net_assets", # Total Net Assets as of Month End
+    "mret": "total_returns", # Total Return per Share as of Month End
+    "mnav": "net_asset_value", # Monthly Net Asset Value per Share
+}
+
+# dtypes of the text columns of the WRDS mutual fund extract
+MUTUAL_FUND_DTYPES = {'ticker': str, 'crsp_fundno': str, 'caldt': str, 'mret': str}
+
+# column names of the WRDS treasury and inflation extract
+BOND_COLUMNS = {
+    "caldt": "date",
+    "b30ret": "30 Year Bond Return",
+    "b30ind": "30 Year Bond Index Level",
+    "b20ret": "20 Year Bond Return",
+    "b20ind": "20 Year Bond Index Level",
+    "b10ret": "10 Year Bond Return",
+    "b10ind": "10 Year Bond Index Level",
+    "b7ret": "7 Year Bond Return",
+    "b7ind": "7 Year Bond Index Level",
+    "b5ret": "5 Year Bond Return",
+    "b5ind": "5 Year Bond Index Level",
+    "b2ret": "2 Year Bond Return",
+    "b2ind": "2 Year Bond Index Level",
+    "b1ret": "1 Year Bond Return",
+    "b1ind": "1 Year Bond Index Level",
+    "t90ret": "90 Day Bond Return",
+    "t90ind": "90 Day Bond Index Level",
+    "t30ret": "30 Day Bond Return",
+    "t30ind": "30 Day Bond Index Level",
+    "cpiret": "CPI Return",
+    "cpiind": "CPI Index Level",
+}
+
+# peak memory budget of the loaders in MB, None for no limit
+MEMORY_BUDGET_MB = None
+
+# rows read at a time from the mutual fund csv
+CSV_CHUNK_ROWS = 500000
+
+# size of pandas or polars dataframes in MB, pass frames that own their columns, not views of each other
+def frame_memory_mb(*frames):
+    size = 0
+    for frame in frames:
+        if hasattr(frame, 'estimated_size'):
+            size += frame.estimated_size()
+        else:
+            size += frame.memory_usage(index=True, deep=True).sum()
+    return size / 2**20
+
+# tracks the size of the frames alive at each loader stage against a budget
+class MemoryBudget:
+    def __init__(self, budget_mb=None):
+        self.budget_mb = MEMORY_BUDGET_MB if budget_mb is None else budget_mb
+        self.peak_mb = 0.0
+        self.peak_stage = None
+
+    # record the frames alive after a stage and raise MemoryError if they exceed the budget
+    # extra_mb: memory of columns added to views of the frames, which are not frames of their own
+    def check(self, stage, *frames, extra_mb=0.0):
+        size_mb = frame_memory_mb(*frames) + extra_mb
+        if size_mb > self.peak_mb:
+            self.peak_mb = size_mb
+            self.peak_stage = stage
+        if self.budget_mb is not None and size_mb > self.budget_mb:
+            raise MemoryError(f"{stage} uses {size_mb:.1f} MB, over the budget of {self.budget_mb:.1f} MB")
+        return size_mb
+
+    def report(self):
+        budget = "no budget" if self.budget_mb is None else f"budget {self.budget_mb:.1f} MB"
+        print(f"Peak memory: {self.peak_mb:.1f} MB at {self.peak_stage} ({budget})")
+
+# number of workers used to parse workbooks and run loaders concurrently
+MAX_WORKERS = 8
+
+# raised by load_all when one or more sources fail to load
+class LoadError(Exception):
+    def __init__(self, errors):
+        # errors maps source name to the exception it raised
+        self.errors = errors
+        message = ", ".join(source + ": " + repr(error) for source, error in errors.items())
+        super().__init__("Failed to load " + message)
+
+# parse workbooks in processes by default when there is more than one cpu: openpyxl is mostly pure python,
+# so threads hardly overlap under the GIL, and on a single cpu processes only add their start up time
+def default_use_processes():
+    return (os.cpu_count() or 1) > 1
+
+# create a thread or process pool for the loaders, use_processes None picks default_use_processes
+def make_executor(use_processes=None, max_workers=MAX_WORKERS):
+    if use_processes is None:
+        use_processes = default_use_processes()
+    if use_processes:
+        # workers come from a clean server process rather than a fork of the loader threads, which may hold locks
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        max_workers = min(max_workers, os.cpu_count() or 1)
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(method))
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+# import one fidelity workbook
+def read_fidelity_file(category):
+    return pd.read_excel("data/mutual_funds/category_largest/" + category + ".xlsx")
+
 # import fidelity data of top 100 active funds by AUM for each category
-def read_fidelity_data():
-    
-    fidelity_data = dict()
-    count = 0
-    for asset_class, category in MUTUAL_FUND_CATEGORIES.keys():
-        count += 1
-        data = pd.read_excel("data/mutual_funds/category_largest/" + category + ".xlsx")
-        fidelity_data[(asset_class, category)] = data
+def read_fidelity_data(use_processes=None):
+    keys = list(MUTUAL_FUND_CATEGORIES)
+
+    # parse every workbook concurrently, keeping the category order
+    with make_executor(use_processes) as executor:
+        frames = executor.map(read_fidelity_file, [category for asset_class, category in keys])
+        fidelity_data = dict(zip(keys, frames))
 
     return fidelity_data
 
@@ -73,30 +187,11 @@ def remove_rows_fidelity_data(fidelity_data):
 
     for key, data in fidelity_data.items():
         asset_class, category = key
-        data = data.copy()
         data = data.iloc[:-21]
         output_data[(asset_class, category)] = data
 
     return output_data
 
-# add tickers from fidelity data to the MUTUAL_FUND_CATEGORIES dictionary
-def add_tickers_fidelity_data(fidelity_data):
-    for key, data in fidelity_data.items():
-        asset_class, category = key
-        names = data["Name"].tolist()
-        
-        # find the ticker inside parentheses
-        tickers = [ name[name.find("(")+1:name.find(")")] for name in names ]
-        MUTUAL_FUND_CATEGORIES[(asset_class, category)] = tickers
-    
-    # reversed dictionary so that tickers are keys and categories are values
-    for category, tickers in MUTUAL_FUND_CATEGORIES.items():
-        for ticker in tickers:
-            MUTUAL_FUND_TICKERS[ticker] = category
-
-    print("Total number of categories", len(MUTUAL_FUND_CATEGORIES))
-    print("Total number of funds:", len(MUTUAL_FUND_TICKERS))
-
 def create_ticker_file_fidelity_data(fidelity_data):
     file = open("data/mutual_funds/all_tickers.txt", "w")
 
@@ -105,7 +200,7 @@ def create_ticker_file_fidelity_data(fidelity_data):
         names = data["Name"].tolist()
         
         # find the ticker inside parentheses
-        tickers = [ name[name.find("(")+1:name.find(")")] for name in names ]
+        tickers = [ fidelity_ticker(name) for name in names ]
         for ticker in tickers:
             file.write(ticker + "\n")
 
@@ -116,69 +211,89 @@ def create_ticker_file_fidelity_data(fidelity_data):
     file.close()
 
 # get fidelity data
-def get_fidelity_data(create_ticker_file=False):
-    fidelity_data = read_fidelity_data()
+def get_fidelity_data(create_ticker_file=False, use_processes=None):
+    fidelity_data = read_fidelity_data(use_processes)
     fidelity_data = remove_rows_fidelity_data(fidelity_data)
-    add_tickers_fidelity_data(fidelity_data)
     if create_ticker_file:
         create_ticker_file_fidelity_data(fidelity_data)
+    return fidelity_data
+
+# build the fund universe from the fidelity data
+def get_fund_universe(use_processes=None):
+    fidelity_data = get_fidelity_data(use_processes=use_processes)
+    universe = FundUniverse.from_fidelity_data(fidelity_data, MUTUAL_FUND_CATEGORIES, BENCHMARK_INDEX_CATEGORIES)
+
+    print("Total number of categories", len(universe.categories))
+    print("Total number of funds:", len(universe))
+    return universe
 
 # import data from WRDS mutual fund monthly returns
-def read_mutual_fund_data():
-    # ticker, crsp_fundno, caldt are strings. mtna, mret, mnav are floats
-    data = pd.read_csv("data/mutual_funds/mutual_fund_data.csv",skiprows=0).dropna(how='any')
+def read_mutual_fund_data(budget=None):
+    # ticker, crsp_fundno, caldt are strings. mtna, mnav are floats, mret is text until the 'R' rows are removed
+    # the dtypes are fixed so every chunk parses a column the same way
+    # read in chunks so the unfiltered extract is never held in memory at once
+    chunks = []
+    for chunk in pd.read_csv("data/mutual_funds/mutual_fund_data.csv", skiprows=0, chunksize=CSV_CHUNK_ROWS,
+                             dtype=MUTUAL_FUND_DTYPES):
+        chunks.append(chunk.dropna(how='any'))
+        if budget is not None:
+            budget.check("read", *chunks)
+    data = pd.concat(chunks)
+    # the chunks are alive until the concatenated frame is returned
+    if budget is not None:
+        budget.check("concat", data, *chunks)
     return data
 
 # rename and drop columns in mutual fund data
 def rename_mutual_fund_data(data):
-    data = data.copy()
-    data = data.rename(
-        columns={
-            "caldt": "date",
-            "mtna": "total_net_assets", # Total Net Assets as of Month End
-            "mret": "total_returns", # Total Return per Share as of Month End
-            "mnav": "net_asset_value", # Monthly Net Asset Value per Share
-        })
-    data = data.drop(columns=["crsp_fundno"])
-    return data
+    return data.rename(columns=MUTUAL_FUND_COLUMNS).drop(columns=["crsp_fundno"])
 
 # remove invalid rows in mutual fund data
 def remove_rows_mutual_fund_data(data):
-    data = data.copy()
-
-    # remove rows with 'R' in total_returns
-    data = data[data.total_returns != 'R']
-
-    # reset index
-    data = data.reset_index(drop=True)
-    return data
+    # remove rows with 'R' in total_returns and reset index, the remaining returns are numbers
+    data = data[data.total_returns != 'R'].reset_index(drop=True)
+    return data.assign(total_returns=data['total_returns'].astype(float))
 
 # convert date column into datetime format in mutual fund data
 def convert_date_mutual_fund_data(data):
-    data = data.copy()
-    data['date'] = pd.to_datetime(data['date'], format='%Y-%m-%d')
-    data['date'] = data['date'] + pd.offsets.MonthEnd(0)
-    return data
+    return data.assign(date=pd.to_datetime(data['date'], format='%Y-%m-%d') + pd.offsets.MonthEnd(0))
+
+# backend name, defaulting to LOADER_BACKEND
+def loader_backend(backend=None):
+    backend = LOADER_BACKEND if backend is None else backend
+    if backend not in LOADER_BACKENDS:
+        raise ValueError(f"unknown loader backend {backend}, expected one of {LOADER_BACKENDS}")
+    return backend
+
+# print the size of the split mutual fund data
+def print_split_summary(split_data, n_empty, n_young):
+    print("Total number of rows:", sum(len(data) for data in split_data.values()))
+    print("Total number of funds with enough data:", len(split_data))
+    print("Funds with no data:", n_empty)
+    print("Funds with less than 5 years of data:", n_young)
+    print("Columns:", split_data[next(iter(split_data))].columns)
+
+# split mutual fund dataframe by ticker, for every fund of the universe
+def split_mutual_fund_data(data, universe, budget=None):
+    # sort once by ticker and date so every ticker is a contiguous slice
+    # the cleaned frame stays alive with its caller while the sorted copy and the split frames are built
+    cleaned = data
+    data = cleaned.sort_values(by=['ticker', 'date'], axis=0, kind='stable').reset_index(drop=True)
+    if budget is not None:
+        budget.check("sort", cleaned, data)
+    tickers, starts, counts = np.unique(data['ticker'].to_numpy(dtype=str), return_index=True, return_counts=True)
+    slices = {ticker: (start, start + count) for ticker, start, count in zip(tickers, starts, counts)}
 
-# split mutual fund dataframe by ticker
-def split_mutual_fund_data(data):
-    data = data.copy()
-    
     split_data = {}
 
-    total_rows = 0
     empty_tickers = []
     young_tickers = []
-    for ticker, ticker_info in MUTUAL_FUND_TICKERS.items():
-        asset_class, category = ticker_info
+    for fund_id in range(len(universe)):
+        ticker, asset_class, category = universe.key(fund_id)
 
-        # filter data by ticker
-        ticker_data = data[data['ticker'] == ticker].copy()
-        ticker_data = ticker_data.reset_index(drop=True)
-
-        # change dates to be sorted properly
-        ticker_data = ticker_data.sort_values(by='date', axis=0)
-        ticker_data = ticker_data.reset_index().drop('index', axis=1)
+        # slice data by ticker, shared with the sorted frame until modified
+        start, end = slices.get(ticker, (0, 0))
+        ticker_data = data.iloc[start:end].reset_index(drop=True)
 
         # ignore tickers with no data
         if len(ticker_data) == 0:
@@ -190,27 +305,43 @@ def split_mutual_fund_data(data):
 
         else:
             # add col nav return to find returns of the nav
-            ticker_data['nav_return'] = ticker_data['net_asset_value'].astype(float).pct_change()
+            ticker_data = ticker_data.assign(nav_return=ticker_data['net_asset_value'].astype(float).pct_change())
 
-            # add ticker data to split data dictionary and update total rows
+            # add ticker data to split data dictionary
             split_data[(ticker, asset_class, category)] = ticker_data
-            total_rows += len(ticker_data)
-    
-    print("Total number of rows:", total_rows)
-    print("Total number of funds with enough data:", len(split_data))
-    print("Funds with no data:", len(empty_tickers))
-    print("Funds with less than 5 years of data:", len(young_tickers))
-    print("Columns:", split_data[next(iter(split_data))].columns)
+
+    # the split frames are views of the sorted frame, only their float nav_return column is new
+    if budget is not None:
+        nav_return_mb = sum(len(ticker_data) for ticker_data in split_data.values()) * 8 / 2**20
+        budget.check("split", cleaned, data, extra_mb=nav_return_mb)
+    print_split_summary(split_data, len(empty_tickers), len(young_tickers))
     return split_data
 
+# read and clean mutual fund data, everything before the split by ticker
+def clean_mutual_fund_data(budget=None):
+    if budget is None:
+        budget = MemoryBudget()
+    raw = read_mutual_fund_data(budget)
+    data = convert_date_mutual_fund_data(remove_rows_mutual_fund_data(rename_mutual_fund_data(raw)))
+    # the raw frame is alive until the cleaned frame is returned
+    budget.check("clean", raw, data)
+    return data
+
 # get and process mutual fund data
-def get_mutual_fund_data():
+def get_mutual_fund_data(universe=None, budget_mb=None, backend=None):
     print("\nMutual Fund Data")
-    data = read_mutual_fund_data()
-    data = rename_mutual_fund_data(data)
-    data = remove_rows_mutual_fund_data(data)
-    data = convert_date_mutual_fund_data(data)
-    data = split_mutual_fund_data(data)
+    backend = loader_backend(backend)
+    # the split needs the tickers from the fidelity data
+    if universe is None:
+        universe = get_fund_universe()
+    budget = MemoryBudget(budget_mb)
+    if backend == "polars":
+        from polars_tools import polars_mutual_fund_data
+        data = polars_mutual_fund_data(universe, budget)
+    else:
+        data = clean_mutual_fund_data(budget)
+        data = split_mutual_fund_data(data, universe, budget)
+    budget.report()
     return data
 
 # import data from WRDS treasury and inflation monthly returns
@@ -220,47 +351,24 @@ def read_bond_data():
 
 # rename columns in bond data
 def rename_bond_data(data):
-    data = data.copy()
-    data = data.rename(
-        columns={
-            "caldt": "date",
-            "b30ret": "30 Year Bond Return",
-            "b30ind": "30 Year Bond Index Level",
-            "b20ret": "20 Year Bond Return",
-            "b20ind": "20 Year Bond Index Level",
-            "b10ret": "10 Year Bond Return",
-            "b10ind": "10 Year Bond Index Level",
-            "b7ret": "7 Year Bond Return",
-            "b7ind": "7 Year Bond Index Level",
-            "b5ret": "5 Year Bond Return",
-            "b5ind": "5 Year Bond Index Level",
-            "b2ret": "2 Year Bond Return",
-            "b2ind": "2 Year Bond Index Level",
-            "b1ret": "1 Year Bond Return",
-            "b1ind": "1 Year Bond Index Level",
-            "t90ret": "90 Day Bond Return",
-            "t90ind": "90 Day Bond Index Level",
-            "t30ret": "30 Day Bond Return",
-            "t30ind": "30 Day Bond Index Level",
-            "cpiret": "CPI Return",
-            "cpiind": "CPI Index Level",
-        })
+    data = data.rename(columns=BOND_COLUMNS)
     data = data.reset_index(drop=True)
     return data
 
 # convert date column into datetime format in bond data
 def convert_date_bond_data(data):
-    data = data.copy()
-    data['date'] = pd.to_datetime(data['date'], format='%Y-%m-%d')
-    data['date'] = data['date'] + pd.offsets.MonthEnd(0)
-    return data
+    return data.assign(date=pd.to_datetime(data['date'], format='%Y-%m-%d') + pd.offsets.MonthEnd(0))
 
 # get bond data
-def get_bond_data():
+def get_bond_data(backend=None):
     print("\nBond Data")
-    data = read_bond_data()
-    data = rename_bond_data(data)
-    data = convert_date_bond_data(data)
+    if loader_backend(backend) == "polars":
+        from polars_tools import polars_bond_data
+        data = polars_bond_data()
+    else:
+        data = read_bond_data()
+        data = rename_bond_data(data)
+        data = convert_date_bond_data(data)
     print("Columns:", data.columns)
     return data
 
@@ -272,37 +380,47 @@ def read_ff_data():
 
 # convert date column into datetime format in fama french data
 def convert_date_ff_data(data):
-    data = data.copy()
-    data['date'] = pd.to_datetime(data['date'], format='%Y%m')
-    data['date'] = data['date'] + pd.offsets.MonthEnd(0)
+    data = data.assign(date=pd.to_datetime(data['date'], format='%Y%m') + pd.offsets.MonthEnd(0))
     print(data)
     return data
 
 # get fama french data
-def get_ff_data():
+def get_ff_data(backend=None):
     print("\nFF Data")
+    if loader_backend(backend) == "polars":
+        from polars_tools import polars_ff_data
+        data = polars_ff_data()
+        print(data)
+        return data
     data = read_ff_data()
     return convert_date_ff_data(data)
 
-# import data from bloomberg benchmark index monthly returns
-def read_index_data():
-    all_index_data = dict()
-    count = 0
-    for ticker, ticker_info in BENCHMARK_INDEX_CATEGORIES.items():
-        count += 1
-        asset_class, category, name = ticker_info
-        if asset_class == "US Fixed Income":
-            index_data = pd.read_excel("data/representative_benchmarks/" + ticker + ".xlsx", skiprows=5)
-        else:
-            index_data = pd.read_excel("data/representative_benchmarks/" + ticker + ".xlsx", skiprows=6)
+# import one bloomberg benchmark index workbook
+def read_index_file(ticker):
+    asset_class, category, name = BENCHMARK_INDEX_CATEGORIES[ticker]
+    if asset_class == "US Fixed Income":
+        index_data = pd.read_excel("data/representative_benchmarks/" + ticker + ".xlsx", skiprows=5)
+    else:
+        index_data = pd.read_excel("data/representative_benchmarks/" + ticker + ".xlsx", skiprows=6)
+
+    # Reorganizing index data
+    index_data['Date'] = pd.to_datetime(index_data['Date'], format='%Y-%m-%d')
+    index_data['Date'] = index_data['Date'] + pd.offsets.MonthEnd(0)
+    index_data = index_data.sort_values(by='Date', axis=0)
+    index_data = index_data.reset_index().drop('index', axis=1)
+    return index_data
 
-        # Reorganizing index data
-        index_data['Date'] = pd.to_datetime(index_data['Date'], format='%Y-%m-%d')
-        index_data['Date'] = index_data['Date'] + pd.offsets.MonthEnd(0)
-        index_data = index_data.sort_values(by='Date', axis=0)
-        index_data = index_data.reset_index().drop('index', axis=1)
-
-        all_index_data[(ticker, asset_class, category, name)] = index_data
+# import data from bloomberg benchmark index monthly returns
+def read_index_data(use_processes=None):
+    tickers = list(BENCHMARK_INDEX_CATEGORIES.keys())
+
+    # parse every workbook concurrently, keeping the ticker order
+    with make_executor(use_processes) as executor:
+        frames = executor.map(read_index_file, tickers)
+        all_index_data = dict()
+        for ticker, index_data in zip(tickers, frames):
+            asset_class, category, name = BENCHMARK_INDEX_CATEGORIES[ticker]
+            all_index_data[(ticker, asset_class, category, name)] = index_data
     return all_index_data
 
 # rename and drop columns in index data
@@ -315,14 +433,62 @@ def rename_index_data(all_index_data):
     print("Columns:", data.columns)
     return all_index_data
 
-def get_index_data():
+def get_index_data(use_processes=None):
     print("\nIndex Data")
-    data = read_index_data()
+    data = read_index_data(use_processes)
     data = rename_index_data(data)
     return data
 
-get_fidelity_data()
-mutual_fund_data = get_mutual_fund_data()
-# bond_data = get_bond_data()
-# ff_data = get_ff_data()
-# index_data = get_index_data()
\ No newline at end of file
+# load every input source concurrently
+def load_all(use_processes=None, budget_mb=None, backend=None):
+    '''
+    use_processes: parse workbooks in a process pool instead of threads, None for default_use_processes
+    budget_mb: peak memory budget of the mutual fund loader, defaults to MEMORY_BUDGET_MB
+    backend: dataframe engine of the csv loaders, defaults to LOADER_BACKEND
+    returns dict with keys universe, mutual_fund, ff, bond, index
+    raises LoadError naming every source that failed
+    '''
+    results = {}
+    errors = {}
+    budget = MemoryBudget(budget_mb)
+    backend = loader_backend(backend)
+    if backend == "polars":
+        import polars_tools
+        # the polars scan waits for the universe so its tickers are pushed down into the csv reader
+        clean = lambda universe_future: polars_tools.clean_mutual_fund_data(universe_future.result().tickers, budget)
+        split = polars_tools.split_mutual_fund_data
+    else:
+        clean, split = (lambda universe_future: clean_mutual_fund_data(budget)), split_mutual_fund_data
+
+    # the split by ticker needs the fund universe, it starts as soon as the universe and the cleaned data are
+    # ready, while the other sources may still be loading; a failed universe fails the mutual fund data too
+    def load_mutual_fund(universe_future, clean_future):
+        universe = universe_future.result()
+        data = clean_future.result()
+        print("\nMutual Fund Data")
+        data = split(data, universe, budget)
+        budget.report()
+        return data
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        universe = executor.submit(get_fund_universe, use_processes)
+        futures = {
+            "universe": universe,
+            "mutual_fund": executor.submit(load_mutual_fund, universe, executor.submit(clean, universe)),
+            "ff": executor.submit(get_ff_data, backend),
+            "bond": executor.submit(get_bond_data, backend),
+            "index": executor.submit(get_index_data, use_processes),
+        }
+
+        for source, future in futures.items():
+            try:
+                results[source] = future.result()
+            except Exception as error:
+                errors[source] = error
+
+    if errors:
+        raise LoadError(errors)
+    return results
+
+if __name__ == "__main__":
+    all_data = load_all()
\ No newline at end of file
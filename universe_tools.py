@@ -0,0 +1,125 @@
+import numpy as np
+from dataclasses import dataclass
+
+
+# find the ticker inside the last parentheses of a fidelity fund name
+def fidelity_ticker(name):
+    return name[name.rfind("(")+1:name.rfind(")")]
+
+# read-only array
+def frozen_array(values, dtype=np.int64):
+    array = np.asarray(values, dtype=dtype)
+    array.setflags(write=False)
+    return array
+
+# immutable registry of funds, categories and benchmarks with dense integer ids
+@dataclass(frozen=True, eq=False)
+class FundUniverse:
+    tickers: tuple             # fund id -> ticker
+    categories: tuple          # category id -> (asset_class, category)
+    asset_classes: tuple       # asset class id -> asset class
+    benchmarks: tuple          # benchmark id -> benchmark index ticker
+    fund_category: np.ndarray  # fund id -> category id
+    category_asset_class: np.ndarray  # category id -> asset class id
+    category_benchmark: np.ndarray    # category id -> benchmark id, -1 if none
+    category_funds: tuple      # category id -> array of fund ids
+    sorted_tickers: np.ndarray  # tickers in sorted order, for lookups
+    sorted_fund_ids: np.ndarray # fund id of every sorted ticker
+
+    # build the universe from the fidelity data, in category order
+    @classmethod
+    def from_fidelity_data(cls, fidelity_data, categories, benchmark_categories):
+        '''
+        fidelity_data: dict of (asset_class, category) -> df, as returned by get_fidelity_data
+        categories: (asset_class, category) pairs in category id order
+        benchmark_categories: dict of benchmark ticker -> (asset_class, category, name)
+        '''
+        categories = tuple(categories)
+        category_ids = {category: i for i, category in enumerate(categories)}
+        asset_classes = tuple(dict.fromkeys(asset_class for asset_class, category in categories))
+        asset_class_ids = {asset_class: i for i, asset_class in enumerate(asset_classes)}
+
+        # a ticker listed in two categories keeps its first one
+        tickers = []
+        fund_category = []
+        seen = set()
+        for category in categories:
+            for name in fidelity_data[category]["Name"].tolist():
+                ticker = fidelity_ticker(name)
+                if ticker not in seen:
+                    seen.add(ticker)
+                    tickers.append(ticker)
+                    fund_category.append(category_ids[category])
+        fund_category = frozen_array(fund_category)
+        ticker_order = np.argsort(np.array(tickers, dtype=str), kind='stable')
+
+        benchmarks = tuple(benchmark_categories.keys())
+        category_benchmark = np.full(len(categories), -1, dtype=np.int64)
+        for benchmark_id, (asset_class, category, name) in enumerate(benchmark_categories.values()):
+            category_benchmark[category_ids[(asset_class, category)]] = benchmark_id
+
+        # fund ids of every category, precomputed once
+        order = np.argsort(fund_category, kind='stable')
+        bounds = np.searchsorted(fund_category[order], np.arange(len(categories) + 1))
+        category_funds = tuple(frozen_array(order[bounds[i]:bounds[i + 1]]) for i in range(len(categories)))
+
+        return cls(
+            tickers=tuple(tickers),
+            categories=categories,
+            asset_classes=asset_classes,
+            benchmarks=benchmarks,
+            fund_category=fund_category,
+            category_asset_class=frozen_array([asset_class_ids[asset_class] for asset_class, category in categories]),
+            category_benchmark=frozen_array(category_benchmark),
+            category_funds=category_funds,
+            sorted_tickers=frozen_array(np.array(tickers, dtype=str)[ticker_order], dtype=str),
+            sorted_fund_ids=frozen_array(ticker_order),
+        )
+
+    def __len__(self):
+        return len(self.tickers)
+
+    # fund ids of tickers, -1 for unknown tickers
+    def fund_ids(self, tickers):
+        tickers = np.asarray(tickers, dtype=str)
+        if len(self.sorted_tickers) == 0:
+            return np.full(tickers.shape, -1, dtype=np.int64)
+        position = np.searchsorted(self.sorted_tickers, tickers).clip(max=len(self.sorted_tickers) - 1)
+        found = self.sorted_tickers[position] == tickers
+        return np.where(found, self.sorted_fund_ids[position], -1)
+
+    # fund id of one ticker
+    def fund_id(self, ticker):
+        fund_id = int(self.fund_ids([ticker])[0])
+        if fund_id < 0:
+            raise KeyError(ticker)
+        return fund_id
+
+    # category id of an (asset_class, category) pair or a category name
+    def category_id(self, category):
+        for i, (asset_class, name) in enumerate(self.categories):
+            if category == (asset_class, name) or category == name:
+                return i
+        raise KeyError(category)
+
+    # fund ids of every category of an asset class
+    def asset_class_funds(self, asset_class):
+        asset_class_id = self.asset_classes.index(asset_class)
+        return np.flatnonzero(self.category_asset_class[self.fund_category] == asset_class_id)
+
+    # category ids of an asset class
+    def asset_class_categories(self, asset_class):
+        return np.flatnonzero(self.category_asset_class == self.asset_classes.index(asset_class))
+
+    # benchmark id of every fund id
+    def fund_benchmark(self, fund_ids):
+        return self.category_benchmark[self.fund_category[fund_ids]]
+
+    # (ticker, asset_class, category) key of a fund id, as used by get_mutual_fund_data
+    def key(self, fund_id):
+        asset_class, category = self.categories[self.fund_category[fund_id]]
+        return (self.tickers[fund_id], asset_class, category)
+
+    # dict of ticker -> (asset_class, category) for every fund
+    def category_map(self):
+        return {ticker: self.categories[category_id] for ticker, category_id in zip(self.tickers, self.fund_category)}